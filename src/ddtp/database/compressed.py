@@ -0,0 +1,119 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import io
+import os
+import bz2
+import gzip
+import zlib
+import hashlib
+import subprocess
+
+# lzma is not in the Python 2 standard library, it is provided by
+# backports.lzma or pyliblzma. Without it we fall back to xzcat.
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Read buffer used for the decompressed streams. The files are read
+# sequentially, so bigger is better.
+BUFFER_SIZE = 1024 * 1024
+
+# The extensions we understand, cheapest to decompress first. This is the
+# order in which find_compressed() looks for variants of a file.
+EXTENSIONS = ['', '.gz', '.xz', '.bz2']
+
+def open_compressed(filename, buffer_size=BUFFER_SIZE):
+    """ Opens a possibly compressed file, based on its extension, and
+    returns a buffered file object with the decompressed contents """
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'r', buffer_size)
+    if filename.endswith('.gz'):
+        return io.BufferedReader(gzip.open(filename, 'rb'), buffer_size)
+    if filename.endswith('.xz'):
+        if lzma is not None:
+            return io.BufferedReader(lzma.LZMAFile(filename, 'rb'), buffer_size)
+        f = subprocess.Popen(['xzcat', filename], stdout=subprocess.PIPE, bufsize=buffer_size)
+        return f.stdout
+    return open(filename, 'rb', buffer_size)
+
+def find_compressed(basename):
+    """ Given a filename without compression extension, returns the
+    cheapest variant that exists on disk, or None if there aren't any """
+    for ext in EXTENSIONS:
+        if os.path.exists(basename + ext):
+            return basename + ext
+    return None
+
+def create_compressed(filename, level=9):
+    """ Creates a file for writing, compressed according to its extension """
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'w', compresslevel=level)
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wb', compresslevel=level)
+    if filename.endswith('.xz'):
+        if lzma is None:
+            raise ValueError("Writing %s requires the lzma module" % filename)
+        return lzma.LZMAFile(filename, 'wb', preset=level)
+    return open(filename, 'wb')
+
+class ChecksumWriter(object):
+    """ A file for writing, compressed according to its extension.  The
+    compression is done in process, so the size and checksums of what
+    actually ends up on disk are known once it's closed, without reading
+    the file back. """
+
+    def __init__(self, filename, level=9):
+        self.filename = filename
+        if filename.endswith('.bz2'):
+            self.compressor = bz2.BZ2Compressor(level)
+        elif filename.endswith('.gz'):
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif filename.endswith('.xz'):
+            if lzma is None:
+                raise ValueError("Writing %s requires the lzma module" % filename)
+            self.compressor = lzma.LZMACompressor(preset=level)
+        else:
+            self.compressor = None
+        self.f = open(filename, 'wb')
+        self.size = 0
+        self.sha1 = hashlib.sha1()
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self._write(data)
+
+    def close(self):
+        if self.compressor:
+            self._write(self.compressor.flush())
+            self.compressor = None
+        self.f.close()
+
+    def _write(self, data):
+        if data:
+            self.f.write(data)
+            self.size += len(data)
+            self.sha1.update(data)
+            self.sha256.update(data)
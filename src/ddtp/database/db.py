@@ -35,16 +35,24 @@ logging.basicConfig()
 logging.getLogger('sqlalchemy.engine').setLevel(logging.DEBUG)
 
 Session = None
+db_engine = None
 
 def get_db_session():
     # create a configured "Session" class
-    global Session
+    global Session, db_engine
     if not Session:
         db_engine = sqlalchemy.create_engine(URL(**settings.DDTP_DATABASE))
         Session = sessionmaker(bind=db_engine)
     # create a Session
     return Session()
 
+def dispose():
+    """ Closes the connections in the pool, e.g. before forking, so child
+    processes don't share them.  Connections of sessions that are still
+    open are not affected, so close those first. """
+    if db_engine is not None:
+        db_engine.dispose()
+
 def with_db_session(view):
     """ Decorator that provides a session argument and cleans up on return """
     @functools.wraps(view)
@@ -18,10 +18,13 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
 from .db import Base
 from sqlalchemy.orm import relationship, collections, aliased, backref
 from sqlalchemy.orm.session import Session
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Date, Float, ForeignKey
 from sqlalchemy.schema import FetchedValue
 
 def description_to_parts(descr):
@@ -40,6 +43,79 @@ def description_to_parts(descr):
 
     return parts
 
+class DescriptionPartsCache(object):
+    """ A bounded cache of the parts of descriptions with their md5s, keyed
+    by description_md5.  The text of a description never changes for a
+    given md5, so entries can't go stale.  When full the least recently
+    used entries are dropped.  Shared by all threads of the process. """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, description_md5, description):
+        """ Returns a tuple of (part, part_md5) for the description """
+        with self.lock:
+            parts = self.entries.pop(description_md5, None)
+            if parts is not None:
+                self.hits += 1
+                self.entries[description_md5] = parts
+                return parts
+            self.misses += 1
+
+        parts = tuple((p, hashlib.md5(p.encode('utf-8')).hexdigest()) for p in description_to_parts(description))
+
+        with self.lock:
+            self.entries[description_md5] = parts
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return parts
+
+    def stats(self):
+        """ Returns a dict with the hits, misses and current size """
+        return dict(hits=self.hits, misses=self.misses, size=len(self.entries))
+
+description_parts_cache = DescriptionPartsCache()
+
+def get_description_parts(description_md5, description):
+    """ Returns a tuple of (part, part_md5) for a description, using the
+    process wide cache if the md5 is known """
+    if description_md5 is None:
+        return tuple((p, hashlib.md5(p.encode('utf-8')).hexdigest()) for p in description_to_parts(description))
+    return description_parts_cache.get(description_md5, description)
+
+def load_part_translations(session, descriptions, language):
+    """ Looks up the parts of the descriptions and their translations into
+    the language in two queries, however many descriptions and parts there
+    are.  Returns a dict mapping description_id to a list of (string, md5,
+    partobj, part), with partobj the PartDescription, if any, and part the
+    Part for the language.  As with partobj.translation, a part only counts
+    as translated if partobj exists. """
+    descr_parts = dict((d.description_id, d.get_description_parts()) for d in descriptions)
+    if not descr_parts:
+        return {}
+
+    part_objs = dict(((p.description_id, p.part_md5), p)
+                     for p in session.query(PartDescription).
+                                      filter(PartDescription.description_id.in_(descr_parts.keys())))
+
+    md5s = set(md5 for parts in descr_parts.itervalues() for text, md5 in parts)
+    translations = dict((p.part_md5, p)
+                        for p in session.query(Part).
+                                         filter(Part.language == language).
+                                         filter(Part.part_md5.in_(md5s)))
+
+    result = {}
+    for description_id, parts in descr_parts.iteritems():
+        result[description_id] = []
+        for text, md5 in parts:
+            part_obj = part_objs.get((description_id, md5))
+            result[description_id].append((text, md5, part_obj, translations.get(md5) if part_obj else None))
+    return result
+
 class DescriptionTag(Base):
     """ Records for each description which releases it was in """
     __tablename__ = 'description_tag_tb'
@@ -60,6 +136,58 @@ class ActiveDescription(Base):
     description_id = Column(Integer, ForeignKey('description_tb.description_id'), primary_key=True)
     description = relationship('Description')
 
+    # A description is active if it has been seen in any tag in the last
+    # ACTIVE_DAYS days. Same window as used for the exports.
+    ACTIVE_DAYS = 7
+
+    @classmethod
+    def refresh(cls, session, full=False):
+        """ Brings active_tb up to date with description_tag_tb. Returns a
+        pair (inserted, removed).
+
+        Each refresh records the number of active descriptions as the
+        'active' statistic. Since every import sets date_end to the day of
+        the import, only descriptions with a date_end since the last refresh
+        can have become active, and only those whose date_end dropped out of
+        the window since then can have become inactive. Without a previous
+        refresh, or with full, the table is rebuilt. """
+        today = date.today()
+        cutoff = today - timedelta(days=cls.ACTIVE_DAYS)
+
+        last = session.query(Statistic).filter(Statistic.stat == 'active'). \
+                       order_by(Statistic.date.desc()).first()
+
+        if full or not last:
+            removed = session.execute("DELETE FROM active_tb").rowcount
+            inserted = session.execute("""INSERT INTO active_tb (description_id)
+                                          SELECT DISTINCT description_id FROM description_tag_tb
+                                           WHERE date_end >= :cutoff""", dict(cutoff=cutoff)).rowcount
+            count = inserted
+        else:
+            since = last.date
+            params = dict(since=since, cutoff=cutoff, expired_since=since - timedelta(days=cls.ACTIVE_DAYS))
+            inserted = session.execute("""INSERT INTO active_tb (description_id)
+                                          SELECT DISTINCT t.description_id FROM description_tag_tb t
+                                           WHERE t.date_end >= :since
+                                             AND t.date_end >= :cutoff
+                                             AND NOT EXISTS (SELECT 1 FROM active_tb a
+                                                              WHERE a.description_id = t.description_id)""", params).rowcount
+            removed = session.execute("""DELETE FROM active_tb
+                                          WHERE description_id IN (SELECT t.description_id FROM description_tag_tb t
+                                                                    WHERE t.date_end >= :expired_since
+                                                                      AND t.date_end < :cutoff)
+                                            AND NOT EXISTS (SELECT 1 FROM description_tag_tb t
+                                                             WHERE t.description_id = active_tb.description_id
+                                                               AND t.date_end >= :cutoff)""", params).rowcount
+            count = last.value + inserted - removed
+
+        if last and last.date == today:
+            last.value = count
+        else:
+            session.add(Statistic(stat='active', date=today, value=count))
+
+        return inserted, removed
+
     def __repr__(self):
         return 'ActiveDescription(%s)' % self.description_id
 
@@ -119,25 +247,13 @@ class Description(Base):
 
     def get_description_parts(self):
         """ Returns a list of (string, md5) which are the parts of this description """
-        parts = description_to_parts(self.description)
+        return list(get_description_parts(self.description_md5, self.description))
 
-        return [(p, hashlib.md5(p.encode('utf-8')).hexdigest()) for p in parts]
-
-    def get_description_part_objects(self):
-        """ Returns a list of (string, md5, partobj) for the parts of this
-        description.
-
-        Note this calculates the parts, you can use the 'parts' property to
-        get the parts in the database """
-        parts = self.get_description_parts()
-
-        # Query the parts in one go, but use the identity to actually match them up
-        self.parts
-
-        return [(p[0], p[1],
-                 Session.object_session(self).
-                         query(PartDescription).
-                         get((self.description_id, p[1]))) for p in parts]
+    def get_description_part_translations(self, language):
+        """ Returns a list of (string, md5, partobj, part) for the parts of
+        this description, where part is the translation into the language,
+        or None.  See load_part_translations(). """
+        return load_part_translations(Session.object_session(self), [self], language)[self.description_id]
 
     def get_potential_fuzzy_matches(self, lang):
         """ Returns a list of pairs (text,Parts) which may be fuzzy matches
@@ -263,6 +379,33 @@ class Packages(Base):
     def __repr__(self):
         return 'Packages(%s, package=%r, source=%r, version=%r)' % (self.packages_id, self.package, self.source, self.version)
 
+class ExportedFile(Base):
+    """ Bookkeeping for export_translations: when the Translation file of a
+    language was last written for a tag """
+    __tablename__ = 'exported_file_tb'
+
+    language = Column(String, primary_key=True)
+    tag = Column(String, primary_key=True)
+    # Time the export started, accepted translations from then on aren't in it
+    timestamp = Column(Integer, nullable=False)
+    date_export = Column(Date, nullable=False)
+
+    def __repr__(self):
+        return 'ExportedFile(%s, %s, %s)' % (self.language, self.tag, self.date_export.strftime("%Y-%m-%d"))
+
+class ImportedFile(Base):
+    """ Bookkeeping for import_mirror: the SHA256 of each mirror file, as
+    listed in the Release file, when it was last imported """
+    __tablename__ = 'imported_file_tb'
+
+    # Path relative to dists/, e.g. sid/main/binary-amd64/Packages.xz
+    filename = Column(String, primary_key=True)
+    sha256 = Column(String, nullable=False)
+    date_import = Column(Date, nullable=False)
+
+    def __repr__(self):
+        return 'ImportedFile(%r, %s, %s)' % (self.filename, self.sha256, self.date_import.strftime("%Y-%m-%d"))
+
 class PartDescription(Base):
     """ Untranslated parts. The actual string comes from the Description table """
 
@@ -300,6 +443,23 @@ class Part(Base):
     def __repr__(self):
         return 'Part(%s, %s, lang=%s)' % (self.part_id, self.part_md5, self.language)
 
+class FuzzyMatch(Base):
+    """ For an untranslated part in an active description, the most similar
+    part that is translated into the language.  Filled in by the
+    update_fuzzy_matches command.  match_md5 is NULL if there is none.
+    last_part_id is the highest part_id of the language when it was
+    matched, parts translated later haven't been compared yet. """
+    __tablename__ = 'fuzzy_match_tb'
+
+    part_md5 = Column(String, primary_key=True)
+    language = Column(String, primary_key=True)
+    match_md5 = Column(String)
+    ratio = Column(Float)
+    last_part_id = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return 'FuzzyMatch(%s, lang=%s, match=%s, ratio=%s)' % (self.part_md5, self.language, self.match_md5, self.ratio)
+
 # There is a ppart table but it has never been used.
 
 class Suggestion(Base):
@@ -350,23 +510,8 @@ class DescriptionMilestone(Base):
 
     def info_language(self, lang):
         session = Session.object_session(self)
-
-        packages, = session.query(func.count(DescriptionMilestone.description_id)). \
-                            filter(DescriptionMilestone.milestone==self.milestone).\
-                            one()
-
-        translated, = session.query(func.count(Translation.description_id)). \
-                            join(DescriptionMilestone, DescriptionMilestone.description_id == Translation.description_id).\
-                            filter(Translation.language==lang.language).\
-                            filter(DescriptionMilestone.milestone==self.milestone).\
-                            one()
-
-        return {
-            'name': self.milestone,
-            'total': packages,
-            'translated': translated,
-            'percent': float(translated)*100.0/packages,
-        }
+        progress = MilestoneProgress.get(session, self.milestone, lang.language)
+        return progress.info()
 
 
     def raw_flot_data_language(self, language):
@@ -390,6 +535,94 @@ class DescriptionMilestone(Base):
     def __repr__(self):
         return 'DescriptionMilestone(%s, milestone=%s, description_id=%s)' % (self.description_milestone_id, self.milestone, self.description_id)
 
+class MilestoneProgress(Base):
+    """ The number of descriptions in a milestone, and how many of those are
+    translated and pending per language.  Accepting and fetching
+    translations update it, and a missing row is counted when next needed.
+    After description_milestone_tb is rebuilt run update_milestone_progress. """
+    __tablename__ = 'milestoneprogress_tb'
+
+    milestone = Column(String, primary_key=True)
+    language = Column(String, primary_key=True)
+    total = Column(Integer, nullable=False)
+    translated = Column(Integer, nullable=False)
+    pending = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return 'MilestoneProgress(milestone=%s, language=%s, total=%s, translated=%s, pending=%s)' % \
+                (self.milestone, self.language, self.total, self.translated, self.pending)
+
+    def info(self):
+        return {
+            'name': self.milestone,
+            'total': self.total,
+            'translated': self.translated,
+            'pending': self.pending,
+            'percent': float(self.translated)*100.0/self.total if self.total else 0.0,
+        }
+
+    @classmethod
+    def count(cls, session, language, milestone=None):
+        """ Stores the progress of the milestone, or all milestones, in the
+        language, for those that are missing """
+        # Serialise with other counts of the same language
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('milestoneprogress ' || :language))", dict(language=language))
+        session.execute("""INSERT INTO milestoneprogress_tb (milestone, language, total, translated, pending)
+                           SELECT m.milestone, :language, count(DISTINCT m.description_id),
+                                  count(DISTINCT t.description_id), count(DISTINCT p.description_id)
+                             FROM description_milestone_tb m
+                             LEFT JOIN translation_tb t ON t.description_id = m.description_id
+                                                       AND t.language = :language
+                             LEFT JOIN pendingtranslations_tb p ON p.description_id = m.description_id
+                                                               AND p.language = :language
+                            WHERE (m.milestone = :milestone OR CAST(:milestone AS text) IS NULL)
+                              AND NOT EXISTS (SELECT 1 FROM milestoneprogress_tb x
+                                               WHERE x.milestone = m.milestone
+                                                 AND x.language = :language)
+                            GROUP BY m.milestone""", dict(language=language, milestone=milestone))
+
+    @classmethod
+    def get(cls, session, milestone, language):
+        """ Returns the progress of the milestone in the language """
+        progress = session.query(cls).get((milestone, language))
+        if progress is None:
+            cls.count(session, language, milestone)
+            progress = session.query(cls).get((milestone, language))
+        return progress
+
+    @classmethod
+    def for_language(cls, session, language):
+        """ Returns the progress of all milestones in the language """
+        missing = session.execute("""SELECT 1 FROM description_milestone_tb m
+                                      WHERE NOT EXISTS (SELECT 1 FROM milestoneprogress_tb x
+                                                         WHERE x.milestone = m.milestone
+                                                           AND x.language = :language)
+                                      LIMIT 1""", dict(language=language)).first()
+        if missing:
+            cls.count(session, language)
+        return session.query(cls).filter(cls.language == language).order_by(cls.milestone).all()
+
+    @classmethod
+    def adjust(cls, session, language, description_id, translated=0, pending=0):
+        """ Adds to the progress of the milestones the description is in """
+        session.execute("""UPDATE milestoneprogress_tb
+                              SET translated = translated + :translated,
+                                  pending = pending + :pending
+                            WHERE language = :language
+                              AND milestone IN (SELECT m.milestone FROM description_milestone_tb m
+                                                 WHERE m.description_id = :description_id)""",
+                        dict(language=language, description_id=description_id, translated=translated, pending=pending))
+
+    @classmethod
+    def invalidate(cls, session, milestones=None):
+        """ Drops the progress of the milestones, or of all, after they were
+        rebuilt """
+        if milestones is None:
+            session.execute("DELETE FROM milestoneprogress_tb")
+        else:
+            session.execute("DELETE FROM milestoneprogress_tb WHERE milestone = ANY(CAST(:milestones AS text[]))",
+                            dict(milestones=list(milestones)))
+
 class CollectionMilestone(Base):
     """ Records for referenc milestone collection"""
     __tablename__ = 'collection_milestone_tb'
@@ -20,16 +20,17 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import re
 import hmac
 import time
-import difflib
 
 from .db import Base
-from .ddtp import Description, Translation, PartDescription, Part, description_to_parts, Statistic, DescriptionMilestone
+from . import fuzzy
+from .ddtp import Description, Part, FuzzyMatch, description_to_parts, Statistic, \
+    MilestoneProgress
 from django.conf import settings
 from django.utils.timesince import timesince
-from sqlalchemy import types, func, desc
+from sqlalchemy import types, desc
 from sqlalchemy.orm import relationship, relation, aliased
 from sqlalchemy.orm.session import Session
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Sequence, text, literal, union_all, exists
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, ForeignKey, Sequence, text
 from datetime import datetime
 
 class TranslationModel(object):
@@ -118,37 +119,7 @@ class Languages(Base):
 
     def get_next_to_translate(self, session):
         """ Use the milestones and priority to find the next description to translate """
-        # This is the query we want:
-        # select description_id from (
-        #         select description_id, 50 as score from languages_tb join description_milestone_tb on (milestone_high=milestone) where language = 'nl'
-        # union all
-        #         select description_id, 30 from languages_tb join description_milestone_tb on (milestone_medium=milestone) where language = 'nl'
-        # union all
-        #         select description_id, 10 from languages_tb join description_milestone_tb on (milestone_low=milestone) where language = 'nl'
-        # union all
-        #         select description_id, prioritize from description_tb
-        # ) x
-        # where not exists (select 1 from translation_tb where translation_tb.description_id = x.description_id)
-        # group by description_id order by sum(score) desc
-        # limit 1;
-        lang_cte = session.query(Languages).filter_by(language=self.language).cte("language")
-
-        prio = session.query(Description.description_id, Description.prioritize)
-        high = session.query(DescriptionMilestone.description_id, literal(50).label("prioritize")).join(lang_cte, lang_cte.c.milestone_high==DescriptionMilestone.milestone)
-        medium = session.query(DescriptionMilestone.description_id, literal(30).label("prioritize")).join(lang_cte, lang_cte.c.milestone_medium==DescriptionMilestone.milestone)
-        low = session.query(DescriptionMilestone.description_id, literal(10).label("prioritize")).join(lang_cte, lang_cte.c.milestone_low==DescriptionMilestone.milestone)
-
-        prio_cte = union_all(prio, high, medium, low).cte()
-
-        q = session.query(prio_cte.c.description_tb_description_id). \
-                    filter(~exists([1], Translation.description_id == prio_cte.c.description_tb_description_id)). \
-                    filter(~exists([1], PendingTranslation.description_id == prio_cte.c.description_tb_description_id)). \
-                    group_by(prio_cte.c.description_tb_description_id). \
-                    order_by(func.sum(prio_cte.c.description_tb_prioritize).desc())
-
-        row = q.first()
-        if row:
-            return row[0]
+        return TranslationQueue.fetch_next(session, self.language)
 
 # /aliases/*
 class Users(Base):
@@ -346,34 +317,59 @@ class PendingTranslation(Base):
 
         if description and language in description.translation:
             return description.translation[language].translation.partition("\n")[0], description.translation[language].translation.partition("\n")[2]
-        parts = description.get_description_part_objects()
-        # A map from untranslated text, to translated text
-        fuzzy_parts = dict( description.get_potential_fuzzy_matches(language) )
+        parts = description.get_description_part_translations(language)
+        untranslated = [hash for text, hash, part, trans in parts if not trans]
+
+        # The fuzzy matches are normally precomputed by update_fuzzy_matches,
+        # a map from part_md5 to the translated Part
+        fuzzy_matches = {}
+        if untranslated:
+            session = Session.object_session(description)
+            fuzzy_matches = dict(session.query(FuzzyMatch.part_md5, Part).
+                                         join(Part, (Part.part_md5 == FuzzyMatch.match_md5) &
+                                                    (Part.language == FuzzyMatch.language)).
+                                         filter(FuzzyMatch.language == language).
+                                         filter(FuzzyMatch.part_md5.in_(untranslated)))
+        # Only for parts without a precomputed match, an index from
+        # untranslated text, to translated text.  The related descriptions
+        # may have been translated after update_fuzzy_matches ran.
+        fuzzy_parts = None
+
         suggest = []
-        for text, hash, part in parts:
-            if part and language in part.translation:
-                suggest.append(part.translation[language].part)
+        for text, hash, part, trans in parts:
+            if trans:
+                suggest.append(trans.part)
             else:
                 # Look for the nearest fuzzy match, and if exists
-                match = difflib.get_close_matches(text, fuzzy_parts.iterkeys(), 1, 0.8)
+                match = fuzzy_matches.get(hash)
+                if match is None:
+                    if fuzzy_parts is None:
+                        fuzzy_parts = fuzzy.TrigramIndex()
+                        for fuzzy_text, fuzzy_part in dict( description.get_potential_fuzzy_matches(language) ).iteritems():
+                            if fuzzy_text is not None:
+                                fuzzy_parts.add(fuzzy_text, fuzzy_part)
+                    match = fuzzy_parts.best_match(text, 0.8)
                 if match:
-                    suggest.append(u" <fuzzy>\n" + fuzzy_parts[match[0]].part)
+                    suggest.append(u" <fuzzy>\n" + match.part)
                 else:
                     suggest.append(u" <trans>\n")
         return suggest[0], " .\n".join(suggest[1:])
 
     @classmethod
-    def make_quick_suggestion(self, description, language):
+    def make_quick_suggestion(self, description, language, parts=None):
         """ From a description object and a language, make a quick suggestion for
-        the description using existing parts, no fuzzy matching """
+        the description using existing parts, no fuzzy matching.  The parts
+        can be passed in if they were already loaded with
+        load_part_translations() """
 
         if description and language in description.translation:
             return description.translation[language].translation.partition("\n")[0], description.translation[language].translation.partition("\n")[2]
-        parts = description.get_description_part_objects()
+        if parts is None:
+            parts = description.get_description_part_translations(language)
         suggest = []
-        for text, hash, part in parts:
-            if part and language in part.translation:
-                suggest.append(part.translation[language].part)
+        for text, hash, part, trans in parts:
+            if trans:
+                suggest.append(trans.part)
             else:
                 suggest.append(u" <trans>\n")
         return suggest[0], " .\n".join(suggest[1:])
@@ -441,6 +437,61 @@ class PendingTranslation(Base):
     def age(self):
         return timesince(datetime.fromtimestamp(self.lastupdate),datetime.fromtimestamp(time.time()))
 
+    # The lists on the dashboard, see summaries()
+    LIST_PENDING_TRANSLATION = 'translation'
+    LIST_PENDING_REVIEW = 'review'
+    LIST_REVIEWED = 'reviewed'
+
+    @classmethod
+    def summaries(cls, session, language, username, which, milestones=(), after=None, limit=100):
+        """ Returns one page of a list on the dashboard of a language, as
+        PendingTranslationSummary objects.  The lists are those pending
+        translation, oldest first, those pending review by the user, oldest
+        update first, and those reviewed or owned by the user, newest update
+        first.  The page starts after the (timestamp, description_id) key of
+        the last entry of the previous page.  Only the columns shown are
+        fetched, milestones lists those the description is flagged with. """
+        params = dict(language=language, username=username, limit=limit,
+                      milestones=[m for m in milestones if m])
+        review_by_user = """EXISTS (SELECT 1 FROM pendingtranslationreview_tb r
+                                     WHERE r.pending_translation_id = p.pending_translation_id
+                                       AND r.username = :username)"""
+        if which == cls.LIST_PENDING_TRANSLATION:
+            params['state'] = cls.STATE_PENDING_TRANSLATION
+            key, direction, condition = 'firstupdate', 'ASC', ''
+        elif which == cls.LIST_PENDING_REVIEW:
+            params['state'] = cls.STATE_PENDING_REVIEW
+            key, direction = 'lastupdate', 'ASC'
+            condition = "AND p.owner_username IS DISTINCT FROM :username AND NOT " + review_by_user
+        elif which == cls.LIST_REVIEWED:
+            params['state'] = cls.STATE_PENDING_REVIEW
+            key, direction = 'lastupdate', 'DESC'
+            condition = "AND (p.owner_username = :username OR %s)" % review_by_user
+        else:
+            raise ValueError("Unknown list %r" % which)
+
+        if after is not None:
+            params['after_key'], params['after_id'] = after
+            condition += " AND (p.%s, p.description_id) %s (:after_key, :after_id)" % (key, '>' if direction == 'ASC' else '<')
+
+        rows = session.execute("""SELECT p.description_id, d.package,
+                                         (SELECT count(*) FROM regexp_split_to_table(d.description, '[[:space:]]+') w
+                                           WHERE w <> ''),
+                                         p.firstupdate, p.lastupdate, p.owner_username, p.owner_locktime, p.iteration,
+                                         (SELECT count(*) FROM pendingtranslationreview_tb r
+                                           WHERE r.pending_translation_id = p.pending_translation_id),
+                                         ARRAY(SELECT m.milestone FROM description_milestone_tb m
+                                                WHERE m.description_id = p.description_id
+                                                  AND m.milestone = ANY(CAST(:milestones AS text[])))
+                                    FROM pendingtranslations_tb p
+                                    JOIN description_tb d ON d.description_id = p.description_id
+                                   WHERE p.language = :language
+                                     AND p.state = :state
+                                     %s
+                                   ORDER BY p.%s %s, p.description_id %s
+                                   LIMIT :limit""" % (condition, key, direction, direction), params)
+        return [PendingTranslationSummary(key, *row) for row in rows]
+
     # Update translation
     def update_translation(self, short, long):
         # FIXME: Check new description has correct numer of paragraphs
@@ -465,39 +516,65 @@ class PendingTranslation(Base):
 
         if ('<trans>' not in short and '<trans>' not in long and
             '<fuzzy>' not in short and '<fuzzy>' not in long):
+            if self.state == PendingTranslation.STATE_PENDING_TRANSLATION:
+                TranslationCounts.adjust(Session.object_session(self), self.language_ref or self.language.language,
+                                         pending_translation=-1, pending_review=1)
             self.state = PendingTranslation.STATE_PENDING_REVIEW
 
         return
 
     # Accept translation. Note: does not check policy, that is the caller's responsibility.
     def accept_translation(self):
-        """ Accepts translation by pushing it into the DDTP """
+        """ Accepts translation by pushing it into the DDTP.  This uses the
+        same number of statements however many parts the description has,
+        since the caller holds a lock on the translation meanwhile. """
         session = Session.object_session(self)
+        # Anything pending for this translation, like a review that was just
+        # added, must be in the database before it's removed below
+        session.flush()
 
-        parts = self.description.get_description_part_objects()
+        parts = [hash for text, hash in self.description.get_description_parts()]
         translated_parts = self.parts
+        if len(translated_parts) < len(parts):
+            raise IndexError("Translation has fewer parts than the description")
+        # If a part occurs twice, the last translation wins
+        part_map = dict(zip(parts, translated_parts))
+        params = dict(description_id=self.description_id,
+                      language=self.language_ref,
+                      translation=self.short + "\n" + self.long + "\n",
+                      md5s=part_map.keys(),
+                      texts=part_map.values(),
+                      pending_translation_id=self.pending_translation_id)
 
         # First create translation object, updating existing if necessary
-        if self.language_ref in self.description.translation:
-            translation = self.description.translation[self.language_ref]
-        else:
-            translation = Translation(description_id=self.description_id, language=self.language_ref)
-            session.add(translation)
-        translation.translation = self.short + "\n" + self.long + "\n"
-
-        # Then update the parts
-        for text, hash, part in parts:
-            # Create Part object if missing
-            if part is None:
-                part = PartDescription(description_id=self.description_id, part_md5=hash)
-                session.add(part)
-            # Can't use magic here, because the PartDescription object might
-            # have just been created but the Part already exists.
-            part_trans = session.query(Part).filter_by(part_md5=hash, language=self.language_ref).first()
-            if not part_trans:
-                part_trans = Part(part_md5=hash, language=self.language_ref)
-                session.add(part_trans)
-            part_trans.part = translated_parts.pop(0)
+        result = session.execute("""UPDATE translation_tb SET translation = :translation
+                                     WHERE description_id = :description_id
+                                       AND language = :language""", params)
+        new_translation = not result.rowcount
+        if new_translation:
+            session.execute("""INSERT INTO translation_tb (description_id, language, translation)
+                               VALUES (:description_id, :language, :translation)""", params)
+            TranslationCounts.add_translation(session, self.language_ref, self.description_id)
+
+        # Then the parts, creating PartDescriptions where missing
+        session.execute("""INSERT INTO part_description_tb (description_id, part_md5)
+                           SELECT :description_id, m.part_md5
+                             FROM unnest(CAST(:md5s AS text[])) AS m(part_md5)
+                            WHERE NOT EXISTS (SELECT 1 FROM part_description_tb pd
+                                               WHERE pd.description_id = :description_id
+                                                 AND pd.part_md5 = m.part_md5)""", params)
+        session.execute("""UPDATE part_tb SET part = v.part
+                             FROM (SELECT unnest(CAST(:md5s AS text[])) AS part_md5,
+                                          unnest(CAST(:texts AS text[])) AS part) v
+                            WHERE part_tb.part_md5 = v.part_md5
+                              AND part_tb.language = :language""", params)
+        session.execute("""INSERT INTO part_tb (part_md5, part, language)
+                           SELECT v.part_md5, v.part, :language
+                             FROM (SELECT unnest(CAST(:md5s AS text[])) AS part_md5,
+                                          unnest(CAST(:texts AS text[])) AS part) v
+                            WHERE NOT EXISTS (SELECT 1 FROM part_tb t
+                                               WHERE t.part_md5 = v.part_md5
+                                                 AND t.language = :language)""", params)
 
         # Add a message indicating acceptance
         message = "Translators/Reviewers: %s\n" \
@@ -512,9 +589,52 @@ class PendingTranslation(Base):
                            timestamp=int(time.time()))
 
         session.add(message)
-        session.delete(self)
+        TranslationQueue.remove(session, self.language_ref, self.description_id)
+        PrefetchedSuggestion.invalidate(session, self.language_ref, self.description_id, part_map.keys())
+        if self.state == PendingTranslation.STATE_PENDING_REVIEW:
+            TranslationCounts.adjust(session, self.language_ref, pending_review=-1)
+        else:
+            TranslationCounts.adjust(session, self.language_ref, pending_translation=-1)
+        MilestoneProgress.adjust(session, self.language_ref, self.description_id,
+                                 translated=1 if new_translation else 0, pending=-1)
+
+        # Finally remove the pending translation and its reviews
+        session.execute("""DELETE FROM pendingtranslationreview_tb
+                            WHERE pending_translation_id = :pending_translation_id""", params)
+        session.execute("""DELETE FROM pendingtranslations_tb
+                            WHERE pending_translation_id = :pending_translation_id""", params)
+        # The ORM didn't see any of the above
+        session.expire(self.description, ['translation', 'translations', 'parts', 'pending_translations'])
         for review in self.reviews:
-            session.delete(review)
+            session.expunge(review)
+        session.expunge(self)
+
+class PendingTranslationSummary(object):
+    """ What the dashboard shows of a pending translation, without loading
+    it or its description.  See PendingTranslation.summaries() """
+
+    def __init__(self, key, description_id, package, wordcount, firstupdate, lastupdate,
+                 owner_username, owner_locktime, iteration, reviews, milestones):
+        self.description_id = description_id
+        self.package = package
+        self.wordcount = wordcount or 0
+        self.firstupdate = firstupdate
+        self.lastupdate = lastupdate
+        self.owner_username = owner_username
+        self.owner_locktime = owner_locktime
+        self.iteration = iteration
+        self.reviews = reviews
+        self.milestones = milestones or []
+        # Where the next page starts, as "timestamp.description_id"
+        self.page_key = '%d.%d' % (getattr(self, key), description_id)
+
+    def is_locked(self):
+        now = time.time()
+        return self.owner_locktime and self.owner_locktime > now - settings.DDTSS_LOCK_TIMEOUT
+
+    @property
+    def age(self):
+        return timesince(datetime.fromtimestamp(self.lastupdate),datetime.fromtimestamp(time.time()))
 
 class PendingTranslationReview(Base):
     """ A review of a translation """
@@ -627,6 +747,417 @@ class Messages(Base):
                           .filter(cls.actionstring=='translation accepted') \
                           .order_by(desc(cls.timestamp))
 
+class TranslationQueue(Base):
+    """ The descriptions next in line to be translated, per language, with
+    their score.  Only the QUEUE_SIZE best are kept, when they run out the
+    queue is refilled from the milestones and priorities.  This keeps the
+    table small while fetching the next description is an indexed LIMIT 1. """
+    __tablename__ = 'translationqueue_tb'
+
+    language_ref = Column('language', String, ForeignKey('languages_tb.language'), primary_key=True)
+    description_id = Column(Integer, ForeignKey('description_tb.description_id'), primary_key=True)
+    score = Column(Integer, nullable=False)
+
+    QUEUE_SIZE = 500
+    # Number of queue entries looked at when claiming one, which limits the
+    # number of concurrent fetches that can succeed
+    CLAIM_CANDIDATES = 50
+
+    def __repr__(self):
+        return '<TranslationQueue %s/%s score=%s>' % (self.language_ref, self.description_id, self.score)
+
+    @classmethod
+    def fetch_next(cls, session, language):
+        """ Returns the description_id of the best description to translate
+        next, or None.  Entries translated or fetched meanwhile are skipped.
+
+        The description is claimed with an advisory lock that is held until
+        the end of the transaction, so concurrent fetches for the language
+        get different descriptions.  This is what SELECT ... FOR UPDATE
+        SKIP LOCKED does, which we can't use before PostgreSQL 9.5.  The
+        claimed description is checked again with a fresh snapshot, because
+        a fetch that committed just before may not have been visible. """
+        params = dict(language=language, candidates=cls.CLAIM_CANDIDATES)
+        refilled = False
+        while True:
+            row = session.execute("""SELECT c.description_id
+                                       FROM (SELECT q.description_id FROM translationqueue_tb q
+                                              WHERE q.language = :language
+                                                AND NOT EXISTS (SELECT 1 FROM translation_tb t
+                                                                 WHERE t.description_id = q.description_id
+                                                                   AND t.language = :language)
+                                                AND NOT EXISTS (SELECT 1 FROM pendingtranslations_tb p
+                                                                 WHERE p.description_id = q.description_id
+                                                                   AND p.language = :language)
+                                              ORDER BY q.score DESC
+                                              LIMIT :candidates) c
+                                      WHERE pg_try_advisory_xact_lock(hashtext(:language), c.description_id)
+                                      LIMIT 1""", params).first()
+            if not row:
+                if refilled:
+                    return None
+                cls.refill(session, language)
+                refilled = True
+                continue
+
+            params['description_id'] = row[0]
+            taken = session.execute("""SELECT EXISTS (SELECT 1 FROM translation_tb t
+                                                       WHERE t.description_id = :description_id
+                                                         AND t.language = :language)
+                                           OR EXISTS (SELECT 1 FROM pendingtranslations_tb p
+                                                       WHERE p.description_id = :description_id
+                                                         AND p.language = :language)""", params).scalar()
+            if not taken:
+                return row[0]
+
+    @classmethod
+    def refill(cls, session, language):
+        """ Replaces the queue of the language with the QUEUE_SIZE best
+        descriptions that are neither translated nor pending.  The score of
+        a description is its priority, plus 50, 30 and 10 if it is in the
+        high, medium or low milestone of the language. """
+        # Serialise refills of the same language.  Not by locking the row
+        # in languages_tb, that conflicts with every insert referencing it.
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('translationqueue ' || :language))", dict(language=language))
+        cls.invalidate(session, language)
+        session.execute("""INSERT INTO translationqueue_tb (language, description_id, score)
+                           SELECT :language, x.description_id, sum(x.score)
+                             FROM (SELECT description_id, prioritize AS score FROM description_tb
+                                   UNION ALL
+                                   SELECT m.description_id, 50 FROM languages_tb l
+                                     JOIN description_milestone_tb m ON m.milestone = l.milestone_high
+                                    WHERE l.language = :language
+                                   UNION ALL
+                                   SELECT m.description_id, 30 FROM languages_tb l
+                                     JOIN description_milestone_tb m ON m.milestone = l.milestone_medium
+                                    WHERE l.language = :language
+                                   UNION ALL
+                                   SELECT m.description_id, 10 FROM languages_tb l
+                                     JOIN description_milestone_tb m ON m.milestone = l.milestone_low
+                                    WHERE l.language = :language) x
+                            WHERE NOT EXISTS (SELECT 1 FROM translation_tb t
+                                               WHERE t.description_id = x.description_id
+                                                 AND t.language = :language)
+                              AND NOT EXISTS (SELECT 1 FROM pendingtranslations_tb p
+                                               WHERE p.description_id = x.description_id
+                                                 AND p.language = :language)
+                            GROUP BY x.description_id
+                            ORDER BY sum(x.score) DESC
+                            LIMIT :size""", dict(language=language, size=cls.QUEUE_SIZE))
+
+    @classmethod
+    def remove(cls, session, language, description_id):
+        """ Called when a description is fetched or translated """
+        session.execute("DELETE FROM translationqueue_tb WHERE language = :language AND description_id = :description_id",
+                        dict(language=language, description_id=description_id))
+
+    @classmethod
+    def invalidate(cls, session, language=None):
+        """ Empties the queue of the language, or of all languages, when the
+        scores may have changed, e.g. after an import or a change of
+        milestones.  It is refilled when next needed. """
+        if language is None:
+            session.execute("DELETE FROM translationqueue_tb")
+        else:
+            session.execute("DELETE FROM translationqueue_tb WHERE language = :language", dict(language=language))
+
+class TranslationCounts(Base):
+    """ The number of translations and pending translations per language,
+    kept up to date by the code that fetches, submits and accepts
+    translations and by update_active, so the index pages don't have to
+    count them.  A missing row is recounted when next needed, and the
+    reconcile_counts command repairs any drift. """
+    __tablename__ = 'translationcounts_tb'
+
+    language_ref = Column('language', String, ForeignKey('languages_tb.language'), primary_key=True)
+    translated = Column(Integer, nullable=False)
+    active_translated = Column(Integer, nullable=False)
+    pending_translation = Column(Integer, nullable=False)
+    pending_review = Column(Integer, nullable=False)
+
+    COLUMNS = ('translated', 'active_translated', 'pending_translation', 'pending_review')
+
+    # The actual counts of a language, in the order of COLUMNS
+    COUNT_QUERY = """SELECT (SELECT count(*) FROM translation_tb t
+                              WHERE t.language = :language),
+                            (SELECT count(*) FROM translation_tb t
+                               JOIN active_tb a ON a.description_id = t.description_id
+                              WHERE t.language = :language),
+                            (SELECT count(*) FROM pendingtranslations_tb p
+                              WHERE p.language = :language AND p.state = :pending_translation),
+                            (SELECT count(*) FROM pendingtranslations_tb p
+                              WHERE p.language = :language AND p.state = :pending_review)"""
+
+    def __repr__(self):
+        return '<TranslationCounts %s translated=%s active_translated=%s pending_translation=%s pending_review=%s>' % \
+                (self.language_ref, self.translated, self.active_translated, self.pending_translation, self.pending_review)
+
+    @classmethod
+    def get(cls, session, language):
+        """ Returns the counts of the language, recounting if needed """
+        counts = session.query(cls).get(language)
+        if counts is None:
+            cls.reconcile(session, language)
+            counts = session.query(cls).get(language)
+        return counts
+
+    @classmethod
+    def get_all(cls, session):
+        """ Returns a dict of the counts of all languages, recounting those
+        that are missing """
+        missing = session.execute("""SELECT l.language FROM languages_tb l
+                                      WHERE NOT EXISTS (SELECT 1 FROM translationcounts_tb c
+                                                         WHERE c.language = l.language)""").fetchall()
+        for language, in missing:
+            cls.reconcile(session, language)
+        return dict((counts.language_ref, counts) for counts in session.query(cls))
+
+    @classmethod
+    def adjust(cls, session, language, pending_translation=0, pending_review=0):
+        """ Adds to the counts of the language, in the caller's transaction """
+        session.execute("""UPDATE translationcounts_tb
+                              SET pending_translation = pending_translation + :pending_translation,
+                                  pending_review = pending_review + :pending_review
+                            WHERE language = :language""",
+                        dict(language=language, pending_translation=pending_translation, pending_review=pending_review))
+
+    @classmethod
+    def add_translation(cls, session, language, description_id):
+        """ Counts a new translation of the description """
+        session.execute("""UPDATE translationcounts_tb
+                              SET translated = translated + 1,
+                                  active_translated = active_translated +
+                                      (SELECT count(*) FROM active_tb WHERE description_id = :description_id)
+                            WHERE language = :language""",
+                        dict(language=language, description_id=description_id))
+
+    @classmethod
+    def refresh_active(cls, session):
+        """ Recounts the active translations of all languages, after
+        active_tb changed """
+        session.execute("""UPDATE translationcounts_tb
+                              SET active_translated = (SELECT count(*) FROM translation_tb t
+                                                         JOIN active_tb a ON a.description_id = t.description_id
+                                                        WHERE t.language = translationcounts_tb.language)""")
+
+    @classmethod
+    def count(cls, session, language):
+        """ Returns the actual counts of the language, as a dict """
+        row = session.execute(cls.COUNT_QUERY,
+                              dict(language=language,
+                                   pending_translation=PendingTranslation.STATE_PENDING_TRANSLATION,
+                                   pending_review=PendingTranslation.STATE_PENDING_REVIEW)).first()
+        return dict(zip(cls.COLUMNS, row))
+
+    @classmethod
+    def reconcile(cls, session, language):
+        """ Replaces the counts of the language with actual counts """
+        # Serialise with other recounts of the same language
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('translationcounts ' || :language))", dict(language=language))
+        cls.invalidate(session, language)
+        params = cls.count(session, language)
+        params['language'] = language
+        session.execute("""INSERT INTO translationcounts_tb (language, translated, active_translated,
+                                                             pending_translation, pending_review)
+                           VALUES (:language, :translated, :active_translated,
+                                   :pending_translation, :pending_review)""", params)
+
+    @classmethod
+    def invalidate(cls, session, language=None):
+        """ Drops the counts of the language, or of all languages, after
+        changes that bypassed adjust() """
+        if language is None:
+            session.execute("DELETE FROM translationcounts_tb")
+        else:
+            session.execute("DELETE FROM translationcounts_tb WHERE language = :language", dict(language=language))
+
+class PrefetchedSuggestion(Base):
+    """ Suggestions precomputed by prefetch_suggestions for the head of the
+    translation queue, so fetching a description doesn't have to wait for
+    make_suggestion().  A row without short/long is a job for the worker.
+    Every fetch is logged to prefetchedsuggestionlog_tb, to see if it's worth it. """
+    __tablename__ = 'prefetchedsuggestion_tb'
+
+    language_ref = Column('language', String, ForeignKey('languages_tb.language'), primary_key=True)
+    description_id = Column(Integer, ForeignKey('description_tb.description_id'), primary_key=True)
+    short = Column(String)
+    long = Column(String)
+    queued = Column(Integer, nullable=False)      # timestamp
+    computed = Column(Integer)                    # timestamp, NULL while queued
+    duration = Column(Float)                      # seconds make_suggestion() took
+
+    description = relationship(Description)
+
+    # Number of descriptions at the head of each queue to keep suggestions for
+    PREFETCH_SIZE = 50
+    # Suggestions older than this (in seconds) are not used, the worker
+    # recomputes them when they are half this age
+    MAX_AGE = 6 * 3600
+
+    def __repr__(self):
+        return '<PrefetchedSuggestion %s/%s computed=%s>' % (self.language_ref, self.description_id, self.computed)
+
+    @classmethod
+    def take(cls, session, description, language):
+        """ Returns the suggestion for a description being fetched, the
+        precomputed one if it's there, otherwise it's made now """
+        if language in description.translation:
+            return PendingTranslation.make_suggestion(description, language)
+
+        now = int(time.time())
+        row = session.execute("""DELETE FROM prefetchedsuggestion_tb
+                                  WHERE language = :language AND description_id = :description_id
+                              RETURNING short, long, computed, duration""",
+                              dict(language=language, description_id=description.description_id)).first()
+        if row and row.computed is not None and row.computed >= now - cls.MAX_AGE:
+            short, long, duration, hit = row.short, row.long, row.duration, True
+        else:
+            start = time.time()
+            short, long = PendingTranslation.make_suggestion(description, language)
+            duration, hit = time.time() - start, False
+
+        session.execute("""INSERT INTO prefetchedsuggestionlog_tb (language, "timestamp", hit, duration)
+                           VALUES (:language, :timestamp, :hit, :duration)""",
+                        dict(language=language, timestamp=now, hit=hit, duration=duration))
+        return short, long
+
+    @classmethod
+    def enqueue(cls, session, language, size=PREFETCH_SIZE):
+        """ Makes sure there is a row for each of the next size descriptions
+        of the queue of the language, and drops the rest """
+        if not session.query(TranslationQueue).filter_by(language_ref=language).first():
+            TranslationQueue.refill(session, language)
+        # Serialise with other workers and refills of the same language,
+        # using the lock TranslationQueue.refill() takes
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('translationqueue ' || :language))", dict(language=language))
+
+        params = dict(language=language, size=size, now=int(time.time()))
+        head = """SELECT q.description_id FROM translationqueue_tb q
+                   WHERE q.language = :language
+                     AND NOT EXISTS (SELECT 1 FROM translation_tb t
+                                      WHERE t.description_id = q.description_id
+                                        AND t.language = :language)
+                     AND NOT EXISTS (SELECT 1 FROM pendingtranslations_tb p
+                                      WHERE p.description_id = q.description_id
+                                        AND p.language = :language)
+                   ORDER BY q.score DESC
+                   LIMIT :size"""
+        session.execute("""DELETE FROM prefetchedsuggestion_tb
+                            WHERE language = :language
+                              AND description_id NOT IN (%s)""" % head, params)
+        session.execute("""INSERT INTO prefetchedsuggestion_tb (language, description_id, queued)
+                           SELECT :language, h.description_id, :now
+                             FROM (%s) h
+                            WHERE NOT EXISTS (SELECT 1 FROM prefetchedsuggestion_tb s
+                                               WHERE s.language = :language
+                                                 AND s.description_id = h.description_id)""" % head, params)
+
+    @classmethod
+    def claim(cls, session, language):
+        """ Returns the description_id of the best queued or stale suggestion
+        of the language, or None.  Like TranslationQueue.fetch_next() it is
+        claimed with an advisory lock, so several workers can run at once. """
+        row = session.execute("""SELECT c.description_id
+                                   FROM (SELECT s.description_id FROM prefetchedsuggestion_tb s
+                                           JOIN translationqueue_tb q ON q.language = s.language
+                                                                     AND q.description_id = s.description_id
+                                          WHERE s.language = :language
+                                            AND (s.computed IS NULL OR s.computed < :stale)
+                                          ORDER BY q.score DESC
+                                          LIMIT :candidates) c
+                                  WHERE pg_try_advisory_xact_lock(hashtext('suggestion ' || :language), c.description_id)
+                                  LIMIT 1""",
+                              dict(language=language, stale=int(time.time()) - cls.MAX_AGE // 2,
+                                   candidates=TranslationQueue.CLAIM_CANDIDATES)).first()
+        return row[0] if row else None
+
+    @classmethod
+    def store(cls, session, language, description_id, short, long, duration):
+        """ Stores a suggestion computed for a claimed row.  If the
+        description was fetched in the meantime the row is gone, and if it
+        was invalidated while being computed the result is out of date.
+        Either way this does nothing. """
+        now = time.time()
+        session.execute("""UPDATE prefetchedsuggestion_tb
+                              SET short = :short, long = :long, computed = :computed, duration = :duration
+                            WHERE language = :language AND description_id = :description_id
+                              AND queued <= :started""",
+                        dict(language=language, description_id=description_id, short=short, long=long,
+                             computed=int(now), duration=duration, started=int(now - duration)))
+
+    @classmethod
+    def invalidate(cls, session, language, description_id, md5s):
+        """ A translation of the description was accepted.  Suggestions that
+        could use its parts, those of descriptions sharing a part or a
+        package or source with it, are queued to be computed again. """
+        session.execute("""UPDATE prefetchedsuggestion_tb s SET short = NULL, long = NULL, computed = NULL, queued = :now
+                            WHERE s.language = :language
+                              AND (EXISTS (SELECT 1 FROM part_description_tb pd
+                                            WHERE pd.description_id = s.description_id
+                                              AND pd.part_md5 = ANY(CAST(:md5s AS text[])))
+                                   OR EXISTS (SELECT 1 FROM description_tb d, description_tb d2
+                                               WHERE d.description_id = :description_id
+                                                 AND d2.description_id = s.description_id
+                                                 AND (d2.package = d.package OR d2.source = d.source)))""",
+                        dict(language=language, description_id=description_id, md5s=list(md5s),
+                             now=int(time.time())))
+
+class FragmentGeneration(Base):
+    """ The generation of each scope of the dashboard fragment cache, see
+    ddtss/fragments.py.  It lives in the database rather than in the cache
+    so an invalidation reaches every process, at the same moment as the
+    change that caused it. """
+    __tablename__ = 'fragmentgeneration_tb'
+
+    scope = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return '<FragmentGeneration %s %s>' % (self.scope, self.generation)
+
+    @classmethod
+    def get(cls, session, scope):
+        """ Returns the generation of the scope, 0 if it was never bumped """
+        return session.execute("SELECT generation FROM fragmentgeneration_tb WHERE scope = :scope",
+                               dict(scope=scope)).scalar() or 0
+
+    @classmethod
+    def bump(cls, session, scope):
+        """ Starts a new generation of the scope, in the caller's
+        transaction """
+        params = dict(scope=scope)
+        update = "UPDATE fragmentgeneration_tb SET generation = generation + 1 WHERE scope = :scope"
+        if session.execute(update, params).rowcount:
+            return
+        # First time, serialise with others inserting the scope
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('fragmentgeneration ' || :scope))", params)
+        if not session.execute(update, params).rowcount:
+            session.execute("INSERT INTO fragmentgeneration_tb (scope, generation) VALUES (:scope, 1)", params)
+
+class FragmentStats(Base):
+    """ Hit and miss counts of the dashboard fragment cache.  Each web
+    process counts in memory and adds its counts here now and then. """
+    __tablename__ = 'fragmentstats_tb'
+
+    fragment = Column(String, primary_key=True)
+    hits = Column(BigInteger, nullable=False)
+    misses = Column(BigInteger, nullable=False)
+
+    def __repr__(self):
+        return '<FragmentStats %s hits=%s misses=%s>' % (self.fragment, self.hits, self.misses)
+
+    @classmethod
+    def add(cls, session, fragment, hits, misses):
+        params = dict(fragment=fragment, hits=hits, misses=misses)
+        update = """UPDATE fragmentstats_tb SET hits = hits + :hits, misses = misses + :misses
+                     WHERE fragment = :fragment"""
+        if session.execute(update, params).rowcount:
+            return
+        session.execute("SELECT pg_advisory_xact_lock(hashtext('fragmentstats ' || :fragment))", params)
+        if not session.execute(update, params).rowcount:
+            session.execute("""INSERT INTO fragmentstats_tb (fragment, hits, misses)
+                               VALUES (:fragment, :hits, :misses)""", params)
+
 class Wordlist(Base):
     """ Entry in a wordlist for a language """
     __tablename__ = 'wordlist_tb'
@@ -0,0 +1,228 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import math
+import heapq
+import cPickle
+import tempfile
+import bisect
+import difflib
+from array import array
+from collections import defaultdict
+
+from sqlalchemy import func
+
+from .ddtp import Description, PartDescription, Part, get_description_parts
+
+# Fuzzy matching of untranslated parts against translated ones, see
+# FUZZY-MATCHING.txt.  Comparing a paragraph with difflib against every
+# candidate gets slow for big source packages, so the candidates are put in
+# an index on their character trigrams first.  Only the few texts sharing
+# the most trigrams are then scored with difflib, using the same 0.8 ratio.
+# Sharing trigrams is not a guarantee: one character changed every few
+# leaves a ratio above 0.8 but hardly any trigrams in common.  So when the
+# trigrams don't give k candidates, every text of a suitable length is
+# scored, like difflib.get_close_matches() does.  check_fuzzy compares the
+# results with that.
+
+def trigrams(text):
+    """ Returns the set of character trigrams of text """
+    return set(text[i:i+3] for i in xrange(len(text) - 2))
+
+class TrigramIndex(object):
+    """ An index of texts by their character trigrams, for finding the
+    texts similar to a given one without looking at all of them.  Each
+    text has a value, e.g. its translation, which is what a lookup
+    returns. """
+
+    def __init__(self, min_shared=0.5):
+        # Texts sharing fewer than this fraction of the trigrams of the text
+        # looked up are only considered by the fallback in closest().
+        # Paragraphs with a ratio of 0.8 usually share far more than that.
+        self.min_shared = min_shared
+        self.texts = []
+        self.values = []
+        self.postings = {}
+        # (length, number) of all texts, sorted when needed
+        self.lengths = []
+        self.lengths_sorted = True
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getstate__(self):
+        # Pickling an array goes through a list of ints, the raw bytes are
+        # far smaller and quicker
+        state = self.__dict__.copy()
+        state['postings'] = dict((gram, posting.tostring()) for gram, posting in self.postings.iteritems())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.postings = dict((gram, array('i', posting)) for gram, posting in self.postings.iteritems())
+
+    def add(self, text, value):
+        n = len(self.texts)
+        self.texts.append(text)
+        self.values.append(value)
+        self.lengths.append((len(text), n))
+        self.lengths_sorted = False
+        for gram in trigrams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(n)
+
+    def candidates(self, text, k=10, cutoff=0.8):
+        """ Returns the numbers of at most k indexed texts most likely to be
+        similar to text, best first.
+
+        A text sharing min_shared of the trigrams of text must share one of
+        the rarest trigrams that remain when leaving out that many of the
+        common ones, so only the (short) postings of those are read.  Texts
+        whose length alone rules out a ratio of cutoff are skipped. """
+        grams = sorted(trigrams(text), key=lambda gram: len(self.postings.get(gram, ())))
+        if not grams:
+            return []
+        prefix = len(grams) - int(math.ceil(self.min_shared * len(grams))) + 1
+
+        hits = defaultdict(int)
+        for gram in grams[:prefix]:
+            for n in self.postings.get(gram, ()):
+                hits[n] += 1
+
+        lo, hi = self._length_range(text, cutoff)
+        return heapq.nlargest(k, (n for n in hits if lo <= len(self.texts[n]) <= hi), key=hits.get)
+
+    def _length_range(self, text, cutoff):
+        """ 2*M/(len(a)+len(b)) >= cutoff can only hold if the lengths are
+        close, returns the range of lengths that can """
+        return len(text) * cutoff / (2 - cutoff), len(text) * (2 - cutoff) / cutoff
+
+    def all_candidates(self, text, cutoff=0.8):
+        """ Returns the numbers of all indexed texts whose length doesn't
+        rule out a ratio of cutoff """
+        if not self.lengths_sorted:
+            self.lengths.sort()
+            self.lengths_sorted = True
+        lo, hi = self._length_range(text, cutoff)
+        start = bisect.bisect_left(self.lengths, (math.ceil(lo), -1))
+        end = bisect.bisect_right(self.lengths, (math.floor(hi), len(self.texts)))
+        return [n for length, n in self.lengths[start:end]]
+
+    def best_match(self, text, cutoff=0.8, k=10):
+        """ Returns the value of the indexed text closest to text, or None.
+        Scores like difflib.get_close_matches(text, texts, 1, cutoff), but
+        only for the k best candidates if there are that many. """
+        match = self.closest(text, cutoff, k)
+        if match is None:
+            return None
+        return match[1]
+
+    def closest(self, text, cutoff=0.8, k=10):
+        """ Like best_match(), but returns a pair (ratio, value), or None """
+        candidates = self.candidates(text, k, cutoff)
+        if len(candidates) < k:
+            # The trigrams ruled out nearly everything, which they can do
+            # wrongly, so check all of them
+            candidates = self.all_candidates(text, cutoff)
+        # best_ratio doubles as the bar for the quick checks
+        best_ratio, best = cutoff, None
+        s = difflib.SequenceMatcher()
+        s.set_seq2(text)
+        for n in candidates:
+            s.set_seq1(self.texts[n])
+            if s.real_quick_ratio() >= best_ratio and s.quick_ratio() >= best_ratio:
+                ratio = s.ratio()
+                if ratio > best_ratio or (ratio == best_ratio and best is None):
+                    best_ratio, best = ratio, n
+        if best is None:
+            return None
+        return best_ratio, self.values[best]
+
+def build_language_index(session, language, after_part_id=None, index=None):
+    """ Returns a TrigramIndex over the English text of all parts translated
+    into the language, with the part_md5 as value.  Meant for batch jobs,
+    for a big language this takes a while and a fair bit of memory.  With
+    after_part_id only the parts added since are included.  If index is
+    given the parts are added to that. """
+    if index is None:
+        index = TrigramIndex()
+    parts = session.query(Part.part_md5).filter(Part.language == language)
+    if after_part_id is not None:
+        parts = parts.filter(Part.part_id > after_part_id)
+    translated = set(part_md5 for part_md5, in parts)
+    if not translated:
+        return index
+
+    descr_ids = session.query(PartDescription.description_id). \
+                        join(Part, Part.part_md5 == PartDescription.part_md5). \
+                        filter(Part.language == language)
+    if after_part_id is not None:
+        descr_ids = descr_ids.filter(Part.part_id > after_part_id)
+    descr_ids = descr_ids.distinct().subquery()
+    for description_md5, description in session.query(Description.description_md5, Description.description). \
+                                                filter(Description.description_id.in_(descr_ids)). \
+                                                yield_per(1000):
+        for part, part_md5 in get_description_parts(description_md5, description):
+            if part_md5 in translated:
+                translated.discard(part_md5)
+                index.add(part, part_md5)
+    return index
+
+def load_language_index(session, language, directory, rebuild=False):
+    """ Like build_language_index(), but keeps the index in a file in
+    directory, so the next time only the parts translated since have to be
+    added.  If parts were removed since, or with rebuild, the whole index
+    is built again. """
+    last_part_id, count = session.query(func.max(Part.part_id), func.count(Part.part_id)). \
+                                  filter(Part.language == language).one()
+    filename = os.path.join(directory, "%s.index" % language)
+
+    saved = None
+    if not rebuild:
+        try:
+            with open(filename, 'rb') as f:
+                saved = cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            pass
+    if saved is not None:
+        saved_part_id, saved_count, index = saved
+        kept = session.query(func.count(Part.part_id)). \
+                       filter(Part.language == language). \
+                       filter(Part.part_id <= saved_part_id).scalar()
+        if kept != saved_count:
+            saved = None
+    if saved is None:
+        index = build_language_index(session, language)
+    elif saved_part_id != (last_part_id or 0):
+        build_language_index(session, language, after_part_id=saved_part_id, index=index)
+    else:
+        return index
+
+    # Write it under another name first, so a run that stops halfway or
+    # runs at the same time never sees half a file
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmpname = tempfile.mkstemp(prefix=language, dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        cPickle.dump((last_part_id or 0, count, index), f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmpname, filename)
+    return index
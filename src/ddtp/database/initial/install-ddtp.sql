@@ -149,6 +149,55 @@ CREATE SEQUENCE description_tb_description_id_seq
 ALTER SEQUENCE description_tb_description_id_seq OWNED BY description_tb.description_id;
 
 
+--
+-- Name: exported_file_tb; Type: TABLE; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE TABLE exported_file_tb (
+    language text NOT NULL,
+    tag text NOT NULL,
+    "timestamp" integer NOT NULL,
+    date_export date NOT NULL
+);
+
+
+--
+-- Name: fuzzy_match_tb; Type: TABLE; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE TABLE fuzzy_match_tb (
+    part_md5 text NOT NULL,
+    language text NOT NULL,
+    match_md5 text,
+    ratio real,
+    last_part_id integer NOT NULL
+);
+
+
+--
+-- Name: imported_file_tb; Type: TABLE; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE TABLE imported_file_tb (
+    filename text NOT NULL,
+    sha256 text NOT NULL,
+    date_import date NOT NULL
+);
+
+
+--
+-- Name: milestoneprogress_tb; Type: TABLE; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE TABLE milestoneprogress_tb (
+    milestone text NOT NULL,
+    language text NOT NULL,
+    total integer NOT NULL,
+    translated integer NOT NULL,
+    pending integer NOT NULL
+);
+
+
 --
 -- Name: owner_tb; Type: TABLE; Schema: public; Owner: ddtp; Tablespace: 
 --
@@ -540,6 +589,38 @@ ALTER TABLE ONLY description_tb
     ADD CONSTRAINT description_tb_pkey PRIMARY KEY (description_id);
 
 
+--
+-- Name: exported_file_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+ALTER TABLE ONLY exported_file_tb
+    ADD CONSTRAINT exported_file_tb_pkey PRIMARY KEY (language, tag);
+
+
+--
+-- Name: fuzzy_match_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+ALTER TABLE ONLY fuzzy_match_tb
+    ADD CONSTRAINT fuzzy_match_tb_pkey PRIMARY KEY (part_md5, language);
+
+
+--
+-- Name: imported_file_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+ALTER TABLE ONLY imported_file_tb
+    ADD CONSTRAINT imported_file_tb_pkey PRIMARY KEY (filename);
+
+
+--
+-- Name: milestoneprogress_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+ALTER TABLE ONLY milestoneprogress_tb
+    ADD CONSTRAINT milestoneprogress_tb_pkey PRIMARY KEY (milestone, language);
+
+
 --
 -- Name: owner_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: ddtp; Tablespace: 
 --
@@ -641,6 +722,20 @@ CREATE INDEX description_tag_tb_new_description_id_key ON description_tag_tb USI
 CREATE INDEX description_tag_tb_new_description_id_key1 ON description_tag_tb USING btree (description_id);
 
 
+--
+-- Name: description_tag_tb_date_begin_idx; Type: INDEX; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE INDEX description_tag_tb_date_begin_idx ON description_tag_tb USING btree (date_begin);
+
+
+--
+-- Name: description_tag_tb_date_end_idx; Type: INDEX; Schema: public; Owner: ddtp; Tablespace: 
+--
+
+CREATE INDEX description_tag_tb_date_end_idx ON description_tag_tb USING btree (date_end);
+
+
 --
 -- Name: description_tb_1_idx; Type: INDEX; Schema: public; Owner: ddtp; Tablespace: 
 --
@@ -15,6 +15,31 @@ SET default_tablespace = '';
 
 SET default_with_oids = false;
 
+--
+-- Name: fragmentgeneration_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE fragmentgeneration_tb (
+    scope character varying NOT NULL,
+    generation integer NOT NULL
+);
+
+
+ALTER TABLE public.fragmentgeneration_tb OWNER TO kleptog;
+
+--
+-- Name: fragmentstats_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE fragmentstats_tb (
+    fragment character varying NOT NULL,
+    hits bigint NOT NULL,
+    misses bigint NOT NULL
+);
+
+
+ALTER TABLE public.fragmentstats_tb OWNER TO kleptog;
+
 --
 -- Name: languages_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
 --
@@ -130,6 +155,65 @@ ALTER TABLE public.pendingtranslations_tb_pending_translation_id_seq OWNER TO kl
 ALTER SEQUENCE pendingtranslations_tb_pending_translation_id_seq OWNED BY pendingtranslations_tb.pending_translation_id;
 
 
+--
+-- Name: prefetchedsuggestion_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE prefetchedsuggestion_tb (
+    language character varying NOT NULL,
+    description_id integer NOT NULL,
+    short character varying,
+    long character varying,
+    queued integer NOT NULL,
+    computed integer,
+    duration double precision
+);
+
+
+ALTER TABLE public.prefetchedsuggestion_tb OWNER TO kleptog;
+
+--
+-- Name: prefetchedsuggestionlog_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE prefetchedsuggestionlog_tb (
+    language character varying NOT NULL,
+    "timestamp" integer NOT NULL,
+    hit boolean NOT NULL,
+    duration double precision NOT NULL
+);
+
+
+ALTER TABLE public.prefetchedsuggestionlog_tb OWNER TO kleptog;
+
+--
+-- Name: translationcounts_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE translationcounts_tb (
+    language character varying NOT NULL,
+    translated integer NOT NULL,
+    active_translated integer NOT NULL,
+    pending_translation integer NOT NULL,
+    pending_review integer NOT NULL
+);
+
+
+ALTER TABLE public.translationcounts_tb OWNER TO kleptog;
+
+--
+-- Name: translationqueue_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE TABLE translationqueue_tb (
+    language character varying NOT NULL,
+    description_id integer NOT NULL,
+    score integer NOT NULL
+);
+
+
+ALTER TABLE public.translationqueue_tb OWNER TO kleptog;
+
 --
 -- Name: userauthority_tb; Type: TABLE; Schema: public; Owner: kleptog; Tablespace: 
 --
@@ -193,6 +277,22 @@ ALTER TABLE ONLY messages_tb ALTER COLUMN message_id SET DEFAULT nextval('messag
 ALTER TABLE ONLY pendingtranslations_tb ALTER COLUMN pending_translation_id SET DEFAULT nextval('pendingtranslations_tb_pending_translation_id_seq'::regclass);
 
 
+--
+-- Name: fragmentgeneration_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+ALTER TABLE ONLY fragmentgeneration_tb
+    ADD CONSTRAINT fragmentgeneration_tb_pkey PRIMARY KEY (scope);
+
+
+--
+-- Name: fragmentstats_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+ALTER TABLE ONLY fragmentstats_tb
+    ADD CONSTRAINT fragmentstats_tb_pkey PRIMARY KEY (fragment);
+
+
 --
 -- Name: languages_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
 --
@@ -233,6 +333,30 @@ ALTER TABLE ONLY pendingtranslations_tb
     ADD CONSTRAINT pendingtranslations_tb_pkey PRIMARY KEY (description_id, language);
 
 
+--
+-- Name: prefetchedsuggestion_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+ALTER TABLE ONLY prefetchedsuggestion_tb
+    ADD CONSTRAINT prefetchedsuggestion_tb_pkey PRIMARY KEY (language, description_id);
+
+
+--
+-- Name: translationcounts_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+ALTER TABLE ONLY translationcounts_tb
+    ADD CONSTRAINT translationcounts_tb_pkey PRIMARY KEY (language);
+
+
+--
+-- Name: translationqueue_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+ALTER TABLE ONLY translationqueue_tb
+    ADD CONSTRAINT translationqueue_tb_pkey PRIMARY KEY (language, description_id);
+
+
 --
 -- Name: userauthority_tb_pkey; Type: CONSTRAINT; Schema: public; Owner: kleptog; Tablespace: 
 --
@@ -257,6 +381,34 @@ ALTER TABLE ONLY wordlist_tb
     ADD CONSTRAINT wordlist_tb_pkey PRIMARY KEY (language, word);
 
 
+--
+-- Name: pendingtranslations_tb_firstupdate_idx; Type: INDEX; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE INDEX pendingtranslations_tb_firstupdate_idx ON pendingtranslations_tb USING btree (language, state, firstupdate, description_id);
+
+
+--
+-- Name: pendingtranslations_tb_lastupdate_idx; Type: INDEX; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE INDEX pendingtranslations_tb_lastupdate_idx ON pendingtranslations_tb USING btree (language, state, lastupdate, description_id);
+
+
+--
+-- Name: prefetchedsuggestionlog_tb_language_idx; Type: INDEX; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE INDEX prefetchedsuggestionlog_tb_language_idx ON prefetchedsuggestionlog_tb USING btree (language, "timestamp");
+
+
+--
+-- Name: translationqueue_tb_score_idx; Type: INDEX; Schema: public; Owner: kleptog; Tablespace: 
+--
+
+CREATE INDEX translationqueue_tb_score_idx ON translationqueue_tb USING btree (language, score);
+
+
 --
 -- Name: messages_tb_language_fkey; Type: FK CONSTRAINT; Schema: public; Owner: kleptog
 --
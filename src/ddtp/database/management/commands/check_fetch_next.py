@@ -0,0 +1,136 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+import threading
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtss
+
+class Command(BaseCommand):
+    """ Hammers TranslationQueue.fetch_next() from many threads at once.
+    Every thread claims descriptions in one transaction, like a translator
+    fetching one after another, and everything is rolled back at the end.
+    No description may be handed out twice. """
+
+    help = "Checks that concurrent fetches hand out distinct descriptions"
+    args = "<lang>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=10,
+                    help='Number of concurrent fetchers (default 10)'),
+        make_option('--fetches', type='int', default=5,
+                    help='Descriptions fetched by each thread (default 5)'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Require a language")
+        language = args[0]
+        threads = options['threads']
+        fetches = options['fetches']
+
+        # Fill the queue up front, so no thread has to refill it while
+        # the others hold their claims
+        session = db.get_db_session()
+        if not session.query(ddtss.Languages).get(language):
+            raise CommandError("Unknown language %s" % language)
+        ddtss.TranslationQueue.refill(session, language)
+        session.commit()
+        queued = session.query(ddtss.TranslationQueue).filter_by(language_ref=language).count()
+        session.close()
+        if queued < threads * fetches:
+            raise CommandError("Queue for %s only has %d entries, need %d" % (language, queued, threads * fetches))
+
+        start = threading.Event()
+        done = threading.Semaphore(0)
+        finish = threading.Event()
+        results = [None] * threads
+
+        def worker(n):
+            session = db.get_db_session()
+            fetched = []
+            timings = []
+            try:
+                start.wait()
+                for i in xrange(fetches):
+                    t = time.time()
+                    description_id = ddtss.TranslationQueue.fetch_next(session, language)
+                    timings.append(time.time() - t)
+                    if description_id is None:
+                        break
+                    fetched.append(description_id)
+                    now = int(time.time())
+                    session.add(ddtss.PendingTranslation(description_id=description_id,
+                                                         language_ref=language,
+                                                         firstupdate=now,
+                                                         lastupdate=now,
+                                                         owner_username='check_fetch_next',
+                                                         owner_locktime=now,
+                                                         iteration=0,
+                                                         state=ddtss.PendingTranslation.STATE_PENDING_TRANSLATION))
+                    session.flush()
+                results[n] = (fetched, timings, None)
+            except Exception, e:
+                results[n] = (fetched, timings, e)
+            # Keep the claims until every thread is done
+            done.release()
+            finish.wait()
+            session.rollback()
+            session.close()
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in xrange(threads)]
+        for w in workers:
+            w.start()
+        t = time.time()
+        start.set()
+        for w in workers:
+            done.acquire()
+        elapsed = time.time() - t
+        finish.set()
+        for w in workers:
+            w.join()
+
+        seen = {}
+        duplicates = 0
+        failed = 0
+        timings = []
+        for n, (fetched, times, error) in enumerate(results):
+            timings.extend(times)
+            if error is not None:
+                self.stdout.write("Thread %d failed: %s\n" % (n, error))
+                failed += 1
+            if len(fetched) < fetches:
+                self.stdout.write("Thread %d only got %d descriptions\n" % (n, len(fetched)))
+            for description_id in fetched:
+                if description_id in seen:
+                    self.stdout.write("Description %d fetched by threads %d and %d\n" % (description_id, seen[description_id], n))
+                    duplicates += 1
+                seen[description_id] = n
+
+        self.stdout.write("%d threads fetched %d descriptions in %.2fs, %.1fms per fetch (max %.1fms)\n" %
+                          (threads, len(seen), elapsed,
+                           1000 * sum(timings) / max(len(timings), 1),
+                           1000 * max(timings or [0])))
+        if duplicates or failed:
+            raise CommandError("%d duplicate fetches, %d failed threads" % (duplicates, failed))
@@ -0,0 +1,88 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+
+import time
+import difflib
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtp, fuzzy
+
+class Command(BaseCommand):
+    """ The trigram index must find the same matches as comparing with
+    every translated part, which is what difflib.get_close_matches() did.
+    This runs both for a sample of untranslated parts of a language and
+    reports any difference and how fast each one is. """
+
+    help = "Compares the fuzzy match index with a scan of all translated parts"
+    args = "<lang>"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sample', type='int', default=100,
+                    help='Number of descriptions whose untranslated parts are looked up (default 100)'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Require a language")
+        lang = args[0]
+        session = db.get_db_session()
+
+        index = fuzzy.build_language_index(session, lang)
+        if not len(index):
+            raise CommandError("Nothing is translated into %s" % lang)
+        translated = set(index.values)
+
+        queries = []
+        for description_md5, description in session.execute("""SELECT d.description_md5, d.description
+                                                                 FROM description_tb d
+                                                                 JOIN active_tb a ON a.description_id = d.description_id
+                                                                ORDER BY random()
+                                                                LIMIT :sample""", dict(sample=options['sample'])):
+            queries.extend(part for part, part_md5 in ddtp.get_description_parts(description_md5, description)
+                           if part_md5 not in translated)
+
+        ours = []
+        start = time.time()
+        for part in queries:
+            ours.append(index.closest(part))
+        ours_time = time.time() - start
+
+        mismatches = 0
+        start = time.time()
+        for part, match in zip(queries, ours):
+            theirs = difflib.get_close_matches(part, index.texts, 1, 0.8)
+            ratio = difflib.SequenceMatcher(None, theirs[0], part).ratio() if theirs else None
+            # Ties may be broken differently, so compare the ratios
+            if (match is None) != (ratio is None) or (ratio is not None and abs(match[0] - ratio) > 1e-9):
+                self.stdout.write("MISMATCH for %r:\n  index: %r\n  scan:  %r (%r)\n" % (part, match, theirs, ratio))
+                mismatches += 1
+        theirs_time = time.time() - start
+
+        self.stdout.write("%s: %d parts against %d translated, %d with a match\n" %
+                          (lang, len(queries), len(index), sum(1 for match in ours if match)))
+        self.stdout.write("  index %.2fs, scan %.2fs, speedup %.1fx\n" %
+                          (ours_time, theirs_time, theirs_time / max(ours_time, 0.001)))
+
+        if mismatches:
+            raise CommandError("%d of %d parts did not match" % (mismatches, len(queries)))
@@ -0,0 +1,95 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+
+from debian.deb822 import Deb822
+from ddtp.database import compressed, paragraphs
+from ddtp.database.management.commands.import_packages import IMPORT_FIELDS
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Cases real files rarely have, always checked first
+SAMPLES = {
+    'comment between continuation lines': [
+        "Package: foo\n",
+        "Description: x\n",
+        "#c: y\n",
+        "\ttab continuation\n",
+        "\n",
+        "Package: bar\n",
+        "# Description: not a field\n",
+        "Description: y\n",
+        " continued\n",
+    ],
+}
+
+class Command(BaseCommand):
+    """ The paragraph scanner used by the import must return exactly what
+    Deb822 would.  This runs both over some samples and real files,
+    compares the results and reports how fast each one is. """
+
+    help = "Compares the paragraph scanner with Deb822 on Packages/Translation files"
+    args = "[Packages|Translation-en ...]"
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for name, lines in sorted(SAMPLES.items()):
+            if not self._compare(name, lambda: iter(lines)):
+                mismatches += 1
+        for filename in args:
+            if not self._compare(filename, lambda: compressed.open_compressed(filename)):
+                mismatches += 1
+
+        if mismatches:
+            raise CommandError("%d files or samples did not match" % mismatches)
+
+    def _compare(self, name, open_lines):
+        """ Parses the lines returned by open_lines() both ways and reports
+        the difference, if any.  Returns whether they matched. """
+        start = time.time()
+        ours = list(paragraphs.iter_paragraphs(open_lines(), IMPORT_FIELDS))
+        ours_time = time.time() - start
+
+        # Not using Deb822's fields argument, it stops at the first
+        # paragraph without any of the fields.
+        start = time.time()
+        theirs = []
+        for para in Deb822.iter_paragraphs(open_lines(), use_apt_pkg=False):
+            para = dict((field, para[field]) for field in IMPORT_FIELDS if field in para)
+            if para:
+                theirs.append(para)
+        theirs_time = time.time() - start
+
+        self.stdout.write("%s: %d paragraphs\n" % (name, len(theirs)))
+        self.stdout.write("  scanner %.2fs (%d/s), Deb822 %.2fs (%d/s), speedup %.1fx\n" %
+                          (ours_time, len(ours) / max(ours_time, 0.001),
+                           theirs_time, len(theirs) / max(theirs_time, 0.001),
+                           theirs_time / max(ours_time, 0.001)))
+
+        if len(ours) != len(theirs):
+            self.stdout.write("  MISMATCH: scanner found %d paragraphs\n" % len(ours))
+            return False
+        for i, (a, b) in enumerate(zip(ours, theirs)):
+            if a != b:
+                self.stdout.write("  MISMATCH in paragraph %d:\n    scanner: %r\n    Deb822:  %r\n" % (i, a, b))
+                return False
+        return True
@@ -17,48 +17,196 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import os
+import time
 from datetime import date, timedelta
-from debian.deb822 import Deb822
-from ddtp.database import db, ddtp
+from optparse import make_option
+from ddtp.database import db, ddtp, ddtss, paragraphs, compressed
 from django.core.management.base import BaseCommand, CommandError
 
 
 class Command(BaseCommand):
     help = "Exports the translation file for a language"
-    args = "lang tag filename"
+    args = "lang tag filename | --all-languages tag output_dir"
+
+    # The compressions we can write, with their extension
+    compressions = {'none': '', 'gz': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
 
     requires_model_validation = False
 
+    option_list = BaseCommand.option_list + (
+        make_option('--all-languages', action='store_true', dest='all_languages', default=False,
+                    help='Export all enabled languages in one pass, writing output_dir/Translation-<lang> and an Index'),
+        make_option('--compress', dest='compress', default='bz2',
+                    help='Comma separated compressions to write with --all-languages: none, gz, bz2, xz (default: bz2). '
+                         'Otherwise the compression follows from the extension of the filename'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='With --all-languages, also write the languages that did not change since the last export'),
+    )
+
     def handle(self, *args, **options):
+        session = db.get_db_session()
+        session.bind.echo=False
+
+        if options.get('all_languages'):
+            if len(args) != 2:
+                raise CommandError("Requires a tag and an output directory")
+            self.export_all(session, args[0], args[1], options)
+            return
+
         if len(args) != 3:
             raise CommandError("Requires a language, a tag and an output filename")
         lang = args[0]
         tag = args[1]
-        filename = args[2]
+        f = self._create(args[2])
+
+        output = self.export(session, tag, {lang: [f]})
+        f.close()
+        if not output[lang]:
+            self.stderr.write("WARNING: No output for tag %r, language %r\n" % (tag, lang))
+
+    def export_all(self, session, tag, output_dir, options):
+        """ Exports all enabled languages for the tag.  Languages without
+        accepted translations or changes to the tag since their last export
+        are skipped, unless forced. """
+        langs = [lang for lang, in session.query(ddtss.Languages.language).
+                                           filter(ddtss.Languages.enabled_ddtss == True).
+                                           order_by(ddtss.Languages.language)]
+        if not langs:
+            raise CommandError("No enabled languages to export")
+
+        exts = []
+        for compress in options.get('compress').split(','):
+            if compress not in self.compressions:
+                raise CommandError("Unknown compression %r" % compress)
+            exts.append(self.compressions[compress])
+
+        start = int(time.time())
+        index_filename = os.path.join(output_dir, 'Index')
+        index = self._read_index(index_filename)
+        exported = dict((e.language, e) for e in session.query(ddtp.ExportedFile).filter_by(tag=tag))
+
+        files = {}
+        published = []
+        for lang in langs:
+            filenames = ['Translation-%s%s' % (lang, ext) for ext in exts]
+            published.extend(filenames)
+            # Only skip when the previous files are still there to publish
+            if (not options.get('force') and lang in exported and
+                    all(filename in index and os.path.exists(os.path.join(output_dir, filename))
+                        for filename in filenames) and
+                    not self._changed(session, lang, tag, exported[lang])):
+                continue
+            files[lang] = [self._create(os.path.join(output_dir, filename)) for filename in filenames]
 
+        self.stdout.write("Exporting %d of %d languages\n" % (len(files), len(langs)))
+        if not files:
+            return
+
+        output = self.export(session, tag, files)
+
+        for lang, fs in files.iteritems():
+            for f in fs:
+                f.close()
+                index[os.path.basename(f.filename)] = (f.size, f.sha1.hexdigest(), f.sha256.hexdigest())
+            if not output[lang]:
+                self.stderr.write("WARNING: No output for tag %r, language %r\n" % (tag, lang))
+
+            if lang not in exported:
+                exported[lang] = ddtp.ExportedFile(language=lang, tag=tag)
+                session.add(exported[lang])
+            exported[lang].timestamp = start
+            exported[lang].date_export = date.today()
+
+        # Languages no longer enabled are dropped from the Index
+        self._write_index(index_filename, dict((name, index[name]) for name in published))
+        session.commit()
+
+    def _changed(self, session, lang, tag, exported):
+        """ True if the Translation file of the language for the tag may
+        have changed since the last export.  That is when translations of
+        descriptions in the tag were accepted since then, or translated
+        descriptions were added to, or dropped out of, the tag. """
+        params = dict(lang=lang, tag=tag, timestamp=exported.timestamp,
+                      since=exported.date_export,
+                      cutoff=date.today() - timedelta(days=ddtp.ActiveDescription.ACTIVE_DAYS),
+                      expired_since=exported.date_export - timedelta(days=ddtp.ActiveDescription.ACTIVE_DAYS))
+        return session.execute("""SELECT EXISTS (SELECT 1 FROM messages_tb m
+                                                   JOIN description_tag_tb t ON t.description_id = m.for_description
+                                                  WHERE m.language = :lang
+                                                    AND m.actionstring = 'translation accepted'
+                                                    AND m.timestamp >= :timestamp
+                                                    AND t.tag = :tag)
+                                      OR EXISTS (SELECT 1 FROM description_tag_tb t
+                                                   JOIN translation_tb tr ON tr.description_id = t.description_id
+                                                  WHERE tr.language = :lang
+                                                    AND t.tag = :tag
+                                                    AND (t.date_begin >= :since
+                                                         OR (t.date_end >= :expired_since AND t.date_end < :cutoff)))""",
+                               params).scalar()
+
+    def _create(self, filename):
+        try:
+            return compressed.ChecksumWriter(filename)
+        except ValueError, e:
+            raise CommandError(str(e))
+
+    def _read_index(self, filename):
+        """ Reads an Index written by _write_index(), returning a dict
+        mapping filename to (size, sha1, sha256).  Used to keep the entries
+        of the files that weren't written this time. """
+        index = {}
+        if not os.path.exists(filename):
+            return index
+        checksums = {}
+        field = None
+        for line in open(filename):
+            if not line.startswith(' '):
+                field = line.strip().rstrip(':')
+                continue
+            checksum, size, name = line.split()
+            checksums.setdefault(name, {})[field] = (int(size), checksum)
+        for name, c in checksums.iteritems():
+            if 'SHA1' in c and 'SHA256' in c:
+                index[name] = (c['SHA1'][0], c['SHA1'][1], c['SHA256'][1])
+        return index
+
+    def _write_index(self, filename, index):
+        """ Writes the i18n/Index listing the checksums and sizes of the
+        files, which were computed while writing them """
         f = open(filename, "w")
+        for field, column in (('SHA1', 1), ('SHA256', 2)):
+            f.write("%s:\n" % field)
+            for name, entry in sorted(index.iteritems()):
+                f.write(" %s %8d %s\n" % (entry[column], entry[0], name))
+        f.close()
 
-        session = db.get_db_session()
-        session.bind.echo=False
+    def export(self, session, tag, files):
+        """ Writes the translations of the active descriptions of the tag,
+        for each language in files (a dict mapping language to a list of
+        files), to the files of that language.  All languages are done in
+        one pass over the descriptions, only fetching the columns needed.  Returns a dict
+        with the number of translations written per language. """
+        output = dict((lang, 0) for lang in files)
+        for package, description_md5, lang, translation in \
+                session.query(ddtp.Description.package, ddtp.Description.description_md5,
+                              ddtp.Translation.language, ddtp.Translation.translation). \
+                        filter(ddtp.Translation.description_id == ddtp.Description.description_id). \
+                        filter(ddtp.Description.description_id == ddtp.DescriptionTag.description_id). \
+                        filter(ddtp.Translation.language.in_(files.keys())). \
+                        filter(ddtp.DescriptionTag.date_end >= date.today()-timedelta(days=ddtp.ActiveDescription.ACTIVE_DAYS)). \
+                        filter(ddtp.DescriptionTag.tag == tag). \
+                        order_by(ddtp.Description.package). \
+                        yield_per(1000):
+            trans_para = [('Package', package),
+                          ('Description-md5', description_md5),
+                          ('Description-%s' % lang, translation)]
 
-        output = False
-        for trans, descr, descr_tag in session.query(ddtp.Translation, ddtp.Description, ddtp.DescriptionTag). \
-                                          filter(ddtp.Translation.description_id == ddtp.Description.description_id). \
-                                          filter(ddtp.Description.description_id == ddtp.DescriptionTag.description_id). \
-                                          filter(ddtp.Translation.language == lang). \
-                                          filter(ddtp.DescriptionTag.date_end >= date.today()-timedelta(days=7)). \
-                                          filter(ddtp.DescriptionTag.tag == tag). \
-                                          order_by(ddtp.Description.package). \
-                                          yield_per(100):
-            trans_para = Deb822()
-            trans_para['Package'] = descr.package
-            trans_para['Description-md5'] = descr.description_md5
-            trans_para['Description-%s' % lang] = trans.translation
-            
             # Minor nagic here: the translation has an extra newline here,
             # which we use to seperate the paragraphs
-            f.write(trans_para.dump().encode('utf-8'))
-            output = True
+            data = paragraphs.dump_paragraph(trans_para).encode('utf-8')
+            for f in files[lang]:
+                f.write(data)
+            output[lang] += 1
 
-        if not output:
-            self.stderr.write("WARNING: No output for tag %r, language %r\n" % (tag, lang))
+        return output
@@ -0,0 +1,55 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ddtp.database import db
+from ddtp.ddtss import fragments
+
+class Command(BaseCommand):
+    """ Reports how often the dashboard fragments came from the cache.  The
+    web processes add their counts to fragmentstats_tb every
+    fragments.STATS_INTERVAL seconds, so the last minute or so is missing. """
+
+    help = "Shows the hit and miss counts of the DDTSS fragment cache"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+                    help='Reset the counters after showing them'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        total_hits = total_misses = 0
+        for name, (hits, misses) in sorted(fragments.stats(session).items()):
+            total_hits += hits
+            total_misses += misses
+            self.stdout.write("%-20s %8d hits %8d misses %5.1f%%\n" %
+                              (name, hits, misses, 100.0 * hits / max(hits + misses, 1)))
+        self.stdout.write("%-20s %8d hits %8d misses %5.1f%%\n" %
+                          ('total', total_hits, total_misses, 100.0 * total_hits / max(total_hits + total_misses, 1)))
+
+        if options['reset']:
+            fragments.reset_stats(session)
+            session.commit()
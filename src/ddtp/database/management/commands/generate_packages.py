@@ -0,0 +1,176 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import random
+import hashlib
+from optparse import make_option
+
+from ddtp.database import compressed, paragraphs
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    """ Writes a Translation-en and Packages files with made up, but
+    realistic looking, descriptions.  The output only depends on the
+    options, so it can be fed to "import_packages --profile" to compare the
+    speed of the import between versions.  Like in the real archive, the
+    descriptions are shared between the architectures and many of them
+    have paragraphs in common. """
+
+    help = "Generates synthetic Packages and Translation-en files for benchmarking the import"
+    args = "output_dir"
+
+    requires_model_validation = False
+
+    option_list = BaseCommand.option_list + (
+        make_option('--packages', type='int', dest='packages', default=50000,
+                    help='Number of binary packages (default: 50000)'),
+        make_option('--arches', type='int', dest='arches', default=2,
+                    help='Number of architectures, each gets a Packages file (default: 2)'),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help='Seed for the random generator (default: 0)'),
+        make_option('--compress', dest='compress', default='gz',
+                    help='Compression of the output: none, gz, bz2 or xz (default: gz)'),
+        make_option('--old-style', action='store_true', dest='old_style', default=False,
+                    help='Put the full description in the Packages files instead of a Translation-en file'),
+    )
+
+    syllables = ['ba', 'con', 'de', 'fi', 'ga', 'lib', 'lo', 'mer', 'nu', 'pro',
+                 'ra', 'ser', 'ta', 'til', 'ver', 'xo', 'zen', 'ing', 'ex', 'ment']
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Require an output directory")
+        output_dir = args[0]
+
+        compress = options.get('compress')
+        if compress not in ('none', 'gz', 'bz2', 'xz'):
+            raise CommandError("Unknown compression %r" % compress)
+        ext = '' if compress == 'none' else '.' + compress
+
+        self.random = random.Random(options.get('seed'))
+        self.words = [self._word() for i in range(2000)]
+        # Paragraphs that many descriptions have in common, e.g. the
+        # "This package contains the debugging symbols" kind.
+        self.common = [self._paragraph() for i in range(200)]
+
+        packages = self._packages(options.get('packages'))
+
+        filenames = []
+        if not options.get('old_style'):
+            filename = os.path.join(output_dir, 'i18n', 'Translation-en' + ext)
+            self._write(filename, self._translation_en(packages))
+            filenames.append(filename)
+        for arch in range(options.get('arches')):
+            filename = os.path.join(output_dir, 'binary-arch%d' % arch, 'Packages' + ext)
+            self._write(filename, self._packages_file(packages, arch, options.get('old_style')))
+            filenames.append(filename)
+
+        self.stdout.write("Wrote %d packages with %d unique descriptions\n" %
+                          (len(packages), len(set(p['md5'] for p in packages))))
+        self.stdout.write("Import with: import_packages --profile <tag> %s\n" % ' '.join(filenames))
+
+    def _word(self):
+        return ''.join(self.random.choice(self.syllables) for i in range(self.random.randint(1, 4)))
+
+    def _sentence(self):
+        words = [self.random.choice(self.words) for i in range(self.random.randint(4, 15))]
+        return ' '.join(words).capitalize() + '.'
+
+    def _paragraph(self):
+        """ Returns a paragraph as a list of lines of at most 72 characters """
+        lines = []
+        line = ''
+        for i in range(self.random.randint(1, 6)):
+            for word in self._sentence().split(' '):
+                if line and len(line) + len(word) >= 72:
+                    lines.append(line)
+                    line = ''
+                line = line + ' ' + word if line else word
+        lines.append(line)
+        return lines
+
+    def _packages(self, count):
+        """ Returns a list of dicts describing the packages.  Packages from
+        the same source often share a description. """
+        packages = []
+        while len(packages) < count:
+            source = '-'.join(self.random.choice(self.words) for i in range(self.random.randint(1, 2)))
+            version = '%d.%d-%d' % (self.random.randint(0, 9), self.random.randint(0, 99), self.random.randint(1, 5))
+            text = None
+            for binary in range(self.random.randint(1, 5)):
+                if text is None or self.random.random() < 0.6:
+                    text = self._description()
+                packages.append(dict(package='%s%d' % (source, binary) if binary else source,
+                                     source=source,
+                                     version=version,
+                                     text=text,
+                                     md5=hashlib.md5(text.encode('utf-8')).hexdigest()))
+        return packages[:count]
+
+    def _description(self):
+        """ Returns the text of a description, including the final newline,
+        as the import sees it """
+        lines = [self._sentence()[:60].rstrip('. ')]
+        for i in range(self.random.randint(1, 4)):
+            if i:
+                lines.append(u' .')
+            if self.random.random() < 0.3:
+                paragraph = self.random.choice(self.common)
+            else:
+                paragraph = self._paragraph()
+            lines.extend(u' ' + line for line in paragraph)
+        return u'\n'.join(lines) + u'\n'
+
+    def _translation_en(self, packages):
+        seen = set()
+        for p in packages:
+            if p['md5'] in seen:
+                continue
+            seen.add(p['md5'])
+            yield [('Package', p['package']),
+                   ('Description-md5', p['md5']),
+                   ('Description-en', p['text'].rstrip(u'\n'))]
+
+    def _packages_file(self, packages, arch, old_style):
+        for p in packages:
+            fields = [('Package', p['package'])]
+            if p['source'] != p['package']:
+                fields.append(('Source', p['source']))
+            fields += [('Version', p['version']),
+                       ('Architecture', 'arch%d' % arch),
+                       ('Installed-Size', str(self.random.randint(10, 100000))),
+                       ('Depends', ', '.join(self.random.sample(self.words, 3)))]
+            if old_style:
+                fields.append(('Description', p['text'].rstrip(u'\n')))
+            else:
+                fields += [('Description', p['text'].split(u'\n', 1)[0]),
+                           ('Description-md5', p['md5'])]
+            fields += [('Filename', 'pool/main/%s/%s_%s_arch%d.deb' % (p['source'][0], p['package'], p['version'], arch)),
+                       ('SHA256', hashlib.sha256(p['package'] + p['version']).hexdigest())]
+            yield fields
+
+    def _write(self, filename, paras):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        f = compressed.create_compressed(filename)
+        for fields in paras:
+            f.write(paragraphs.dump_paragraph(fields).encode('utf-8'))
+            f.write('\n')
+        f.close()
@@ -19,8 +19,14 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
 import re
+import multiprocessing
+from datetime import date
+from optparse import make_option
+from debian.deb822 import Release
 from django.core.management.base import BaseCommand, CommandError
 
+from ddtp.database import db, ddtp, compressed
+
 from django.core import management
 
 class Command(BaseCommand):
@@ -33,6 +39,17 @@ class Command(BaseCommand):
 
     requires_model_validation = False
 
+    option_list = BaseCommand.option_list + (
+        make_option('--bulk', action='store_true', dest='bulk', default=False,
+                    help='Merge using set-based statements, see import_packages'),
+        make_option('--jobs', type='int', dest='jobs', default=multiprocessing.cpu_count(),
+                    help='Number of processes used to parse the Packages files (default: number of CPUs)'),
+        make_option('--low-memory', action='store_true', dest='low_memory', default=False,
+                    help='Keep the Translation-en texts on disk instead of in memory, see import_packages'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='Import even if the Release file says nothing changed since the last import'),
+    )
+
     dist_comp_RE = re.compile(r'^[a-z-]+/[a-z-]+$')
 
     def handle(self, *args, **options):
@@ -47,6 +64,12 @@ class Command(BaseCommand):
         if not os.path.exists(os.path.join(path,'dists')):
             raise CommandError("Given path %r does appear to be mirror, expected 'dists' directory" % path)
 
+        session = db.get_db_session()
+        session.bind.echo=False
+
+        # Work out the files of every dist/component first, since the
+        # components of a distribution can only be skipped together.
+        plans = []
         for tag in tags:
             if not self.dist_comp_RE.match(tag):
                 raise CommandError("Argument %r invalid, expect e.g. sid/main, wheezy/contrib, etc..." % tag)
@@ -62,17 +85,130 @@ class Command(BaseCommand):
 
             args = [dist]
 
-            # Looks for a english translation file
-            trans_path = os.path.join(dist_path, 'i18n/Translation-en.bz2')
-            if os.path.exists(trans_path):
+            # Looks for a english translation file, in whichever
+            # compression is cheapest to read
+            trans_path = compressed.find_compressed(os.path.join(dist_path, 'i18n/Translation-en'))
+            if trans_path:
                 args.append(trans_path)
 
             # Process any binary architectures we find
             for arch in os.listdir(dist_path):
                 if arch.startswith('binary-'):
-                    package_path = os.path.join(dist_path, arch, 'Packages.bz2')
-                    if os.path.exists(package_path):
+                    package_path = compressed.find_compressed(os.path.join(dist_path, arch, 'Packages'))
+                    if package_path:
                         args.append(package_path)
 
+            # Look up the checksums of the files, keyed by their path relative
+            # to dists/ so they're independent of where the mirror is.
+            release_path = os.path.join(path, 'dists', tag.split('/')[0])
+            release = self._read_release(release_path)
+            checksums = {}
+            for filename in args[1:]:
+                name = os.path.relpath(filename, release_path)
+                checksums[dist + '/' + name] = release.get(name)
+
+            # Plain values, the session is closed during the imports
+            imported = dict((f.filename, (f.sha256, f.date_import))
+                            for f in session.query(ddtp.ImportedFile).
+                                             filter(ddtp.ImportedFile.filename.in_(checksums.keys())))
+            plans.append((tag, dist, args, checksums, imported))
+
+        skip = set()
+        if not options.get('force'):
+            for dist in set(plan[1] for plan in plans):
+                dist_plans = [plan for plan in plans if plan[1] == dist]
+                if self._dist_unchanged(session, dist, dist_plans):
+                    skip.add(dist)
+
+        for dist in skip:
+            imported = {}
+            for plan in plans:
+                if plan[1] == dist:
+                    imported.update(plan[4])
+            self._refresh_tag(session, dist, imported)
+        session.commit()
+        # An import takes hours, don't sit idle in a transaction meanwhile
+        session.close()
+
+        for tag, dist, args, checksums, imported in plans:
+            if dist in skip:
+                self.stdout.write("Skipping %s, unchanged since last import\n" % tag)
+                continue
+
             self.stdout.write("Command: %s\n" % args)
-            management.call_command('import_packages', *args)
+            management.call_command('import_packages', *args, bulk=options.get('bulk'), jobs=options.get('jobs'),
+                                    low_memory=options.get('low_memory'))
+
+            session = db.get_db_session()
+            self._record_imported(session, checksums, imported)
+            session.commit()
+            session.close()
+
+        # Descriptions that appeared or disappeared in this run
+        management.call_command('update_active')
+        # Fuzzy matches for the parts that are new
+        management.call_command('update_fuzzy_matches')
+
+    def _read_release(self, release_path):
+        """ Returns a dict mapping filename to SHA256 from the Release file
+        of a distribution. Empty if there is no Release file. """
+        for name in ('Release', 'InRelease'):
+            filename = os.path.join(release_path, name)
+            if os.path.exists(filename):
+                release = Release(open(filename))
+                return dict((f['name'], f['sha256']) for f in release.get('SHA256', []))
+        return {}
+
+    def _unchanged(self, checksums, imported):
+        """ True if every file has a known checksum equal to the one it had
+        when it was last imported.  The files of a dist/component are
+        treated as a unit, since skipping only some of them would leave the
+        tags of their descriptions out of date. """
+        if not checksums or None in checksums.values():
+            return False
+        return all(imported.get(filename, (None, None))[0] == sha256 for filename, sha256 in checksums.iteritems())
+
+    def _dist_unchanged(self, session, dist, plans):
+        """ True if the distribution can be skipped as a whole.  The tag of
+        a description only names the distribution, not the component, so
+        refreshing it is only right when every component that was part of
+        the last import is being imported now and none of them changed. """
+        if not all(self._unchanged(checksums, imported) for _, _, _, checksums, imported in plans):
+            return False
+        last_import = max(date_import for _, _, _, _, imported in plans for _, date_import in imported.itervalues())
+        current = set(filename for _, _, _, checksums, _ in plans for filename in checksums)
+        recorded = session.query(ddtp.ImportedFile.filename). \
+                filter(ddtp.ImportedFile.filename.like(dist + '/%')). \
+                filter(ddtp.ImportedFile.date_import >= last_import)
+        return all(filename in current for filename, in recorded)
+
+    def _refresh_tag(self, session, tag, imported):
+        """ Nothing changed in any component of the distribution, so
+        everything that was current at the last import is still current.
+        Move date_end forward like the import would have done. """
+        today = date.today()
+        last_import = max(date_import for _, date_import in imported.itervalues())
+        if last_import < today:
+            session.query(ddtp.DescriptionTag). \
+                    filter(ddtp.DescriptionTag.tag == tag). \
+                    filter(ddtp.DescriptionTag.date_end == last_import). \
+                    update({'date_end': today}, synchronize_session=False)
+        session.query(ddtp.ImportedFile). \
+                filter(ddtp.ImportedFile.filename.in_(imported.keys())). \
+                update({'date_import': today}, synchronize_session=False)
+
+    def _record_imported(self, session, checksums, imported):
+        """ Store the checksums of the files we just imported """
+        today = date.today()
+        known = {}
+        if imported:
+            known = dict((f.filename, f) for f in session.query(ddtp.ImportedFile).
+                                                         filter(ddtp.ImportedFile.filename.in_(imported.keys())))
+        for filename, sha256 in checksums.iteritems():
+            if sha256 is None:
+                continue
+            if filename not in known:
+                known[filename] = ddtp.ImportedFile(filename=filename)
+                session.add(known[filename])
+            known[filename].sha256 = sha256
+            known[filename].date_import = today
@@ -18,33 +18,412 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import re
+import array
+import anydbm
+import shutil
+import os.path
+import binascii
 import hashlib
-import subprocess
+import time
+import tempfile
+import itertools
+import multiprocessing
 
-from collections import defaultdict
+from cStringIO import StringIO
+from collections import defaultdict, deque
 from datetime import date
-from debian.deb822 import Deb822
-from ddtp.database import db, ddtp
+from optparse import make_option
+from ddtp.database import db, ddtp, ddtss, compressed, paragraphs
 from django.core.management.base import BaseCommand, CommandError
 
 
+# The only fields of Packages and Translation-en the import looks at
+IMPORT_FIELDS = ('Package', 'Source', 'Version', 'Description', 'Description-md5', 'Description-en')
+
+def copy_escape(value):
+    """ Escapes a value for the text format of COPY """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class ImportProfile(object):
+    """ Collects the time spent in, and the number of rows handled by, each
+    phase of the import for --profile.  When phases are nested, the time is
+    only counted for the innermost one. """
+
+    PHASES = ('decompress', 'parse', 'hash', 'lookup', 'flush', 'merge', 'commit')
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.rows = defaultdict(int)
+        self.stack = []
+        self.start = time.time()
+
+    def phase(self, name, rows=1):
+        """ Returns a context manager timing its body as the given phase """
+        return _ProfilePhase(self, name, rows)
+
+    def iterate(self, iterable, name):
+        """ Yields the items of iterable, timing the fetching of each item as
+        the given phase """
+        it = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._exit(name, 0)
+            self.rows[name] += 1
+            yield item
+
+    def add_rows(self, name, rows):
+        self.rows[name] += rows
+
+    def _enter(self, name):
+        self.stack.append((name, time.time()))
+
+    def _exit(self, name, rows):
+        name, start = self.stack.pop()
+        elapsed = time.time() - start
+        self.times[name] += elapsed
+        self.rows[name] += rows
+        if self.stack:
+            self.times[self.stack[-1][0]] -= elapsed
+
+    def report(self, out):
+        total = time.time() - self.start
+        out.write("%-12s %10s %10s %10s\n" % ('Phase', 'Seconds', 'Rows', 'Rows/s'))
+        for name in self.PHASES:
+            seconds = self.times[name]
+            rows = self.rows[name]
+            out.write("%-12s %10.2f %10d %10d\n" % (name, seconds, rows, rows / max(seconds, 0.001)))
+        out.write("%-12s %10.2f\n" % ('other', total - sum(self.times.values())))
+        out.write("%-12s %10.2f\n" % ('total', total))
+
+class _ProfilePhase(object):
+    __slots__ = ('profile', 'name', 'rows')
+
+    def __init__(self, profile, name, rows):
+        self.profile = profile
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.profile._enter(self.name)
+
+    def __exit__(self, *exc):
+        self.profile._exit(self.name, self.rows)
+
+class NullProfile(object):
+    """ Stands in for ImportProfile when not profiling, doing as little as
+    possible """
+
+    def phase(self, name, rows=1):
+        return self
+
+    def iterate(self, iterable, name):
+        return iterable
+
+    def add_rows(self, name, rows):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+class DescriptionIndex(object):
+    """ A compact map from description md5 to description_id, so the import
+    can check for existing descriptions without loading them.  The md5s of
+    the existing descriptions are kept as 16 byte digests in one sorted
+    string, with the ids in a parallel array.  Descriptions added during
+    the import go in a dict. """
+
+    def __init__(self, session):
+        digests = bytearray()
+        self.ids = array.array('l')
+        # Stream the rows, the whole table doesn't fit comfortably in memory
+        # as tuples.  Collate "C" sorts the hex the same way as the digests.
+        result = session.connection().execution_options(stream_results=True). \
+                         execute("SELECT description_md5, description_id FROM description_tb "
+                                 "ORDER BY description_md5 COLLATE \"C\"")
+        for md5, description_id in result:
+            digests.extend(binascii.unhexlify(md5))
+            self.ids.append(description_id)
+        self.digests = str(digests)
+        self.added = {}
+
+    def get(self, md5):
+        """ Returns the description_id for the md5, or None if unknown """
+        digest = binascii.unhexlify(md5)
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = self.digests[mid*16:mid*16+16]
+            if other < digest:
+                lo = mid + 1
+            elif other > digest:
+                hi = mid
+            else:
+                return self.ids[mid]
+        return self.added.get(digest)
+
+    def add(self, md5, description_id):
+        """ Record a newly created description """
+        self.added[binascii.unhexlify(md5)] = description_id
+
+class DiskTextMap(object):
+    """ Stands in for the md5 to description text dict, but keeps the texts
+    in a temporary on-disk key-value store so memory use doesn't grow with
+    the size of the archive.  Texts are decoded when they're looked up.
+    With --jobs every worker fills its own store, in a subdirectory of the
+    main one, which is then merged in. """
+
+    def __init__(self, parent=None):
+        self.dir = tempfile.mkdtemp(prefix='import_packages', dir=parent)
+        self.db = anydbm.open(os.path.join(self.dir, 'texts'), 'n')
+
+    def __setitem__(self, md5, text):
+        self.db[md5.encode('ascii')] = text.encode('utf-8')
+
+    def get(self, md5, default=None):
+        text = self.db.get(md5.encode('ascii'))
+        if text is None:
+            return default
+        return text.decode('utf-8')
+
+    def update(self, texts):
+        for md5, text in texts.iteritems():
+            self[md5] = text
+
+    def detach(self):
+        """ Closes the store but leaves it on disk, for merging into the
+        main store in another process.  Returns its directory. """
+        self.db.close()
+        return self.dir
+
+    def merge(self, dir):
+        """ Moves the texts of a detached store into this one, one at a
+        time, and removes it.  Returns the number of texts. """
+        other = anydbm.open(os.path.join(dir, 'texts'), 'r')
+        try:
+            keys = other.keys()
+            for key in keys:
+                self.db[key] = other[key]
+            return len(keys)
+        finally:
+            other.close()
+            shutil.rmtree(dir)
+
+    def close(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+def parse_packages_file(filename, text_dir=None):
+    """ Parses a Packages or Translation-en file, for running in a worker
+    process.  Returns a tuple (texts, paras, count) where texts maps md5 to
+    description text, paras is a list of ((md5, package, version), para)
+    with the paragraphs reduced to the fields the import uses and
+    duplicates removed, and count is the number of package paragraphs.
+    With a text_dir the texts are written to a DiskTextMap under it
+    instead, and texts is the directory of that store. """
+    texts = DiskTextMap(text_dir) if text_dir else {}
+    paras = {}
+    count = 0
+    f = compressed.open_compressed(filename)
+    for para in paragraphs.iter_paragraphs(f, IMPORT_FIELDS):
+        if 'Description-en' in para:
+            md5 = para['Description-md5']
+            text = para['Description-en'] + "\n"
+
+            assert md5 == hashlib.md5(text.encode('utf-8')).hexdigest()
+
+            texts[md5] = text
+        if 'Version' in para:
+            count += 1
+            if 'Description-md5' not in para and 'Description' in para:
+                # Old style, hash here so the writer doesn't have to
+                text = para.pop('Description') + "\n"
+                md5 = hashlib.md5(text.encode('utf-8')).hexdigest()
+                texts[md5] = text
+                para['Description-md5'] = md5
+            # The writer only needs the md5 from here on
+            para.pop('Description', None)
+            key = (para.get('Description-md5'), para.get('Package'), para.get('Version'))
+            paras.setdefault(key, para)
+    if text_dir:
+        texts = texts.detach()
+    return texts, paras.items(), count
+
 class Command(BaseCommand):
     help = "Imports a package file into the database"
     args = "tag [Translation-en] <Packages Packages ...>"
 
     requires_model_validation = False
 
+    option_list = BaseCommand.option_list + (
+        make_option('--bulk', action='store_true', dest='bulk', default=False,
+                    help='Stage all paragraphs in temporary tables and merge them with set-based statements'),
+        make_option('--jobs', type='int', dest='jobs', default=1,
+                    help='Number of processes used to parse the files in parallel'),
+        make_option('--low-memory', action='store_true', dest='low_memory', default=False,
+                    help='Keep the Translation-en texts in a temporary on-disk store instead of in memory'),
+        make_option('--profile', action='store_true', dest='profile', default=False,
+                    help='Report the time spent in each phase of the import'),
+    )
+
     comma_sep_RE = re.compile(r'\s*,\s*')
 
+    # Staging tables for --bulk.  These play the role packages_tb was meant
+    # to, but only live for the duration of the import transaction.
+    bulk_tables = [
+        ('import_packages_tmp', ('package', 'source', 'version', 'description_md5'),
+         """CREATE TEMP TABLE import_packages_tmp (
+                package text NOT NULL,
+                source text NOT NULL,
+                version text NOT NULL,
+                description_md5 text NOT NULL
+            ) ON COMMIT DROP"""),
+        ('import_descriptions_tmp', ('description_md5', 'description', 'package', 'source'),
+         """CREATE TEMP TABLE import_descriptions_tmp (
+                description_md5 text PRIMARY KEY,
+                description text NOT NULL,
+                package text NOT NULL,
+                source text NOT NULL,
+                description_id integer
+            ) ON COMMIT DROP"""),
+        ('import_parts_tmp', ('description_md5', 'part_md5'),
+         """CREATE TEMP TABLE import_parts_tmp (
+                description_md5 text NOT NULL,
+                part_md5 text NOT NULL
+            ) ON COMMIT DROP"""),
+    ]
+
+    # Number of staged rows to buffer before sending them with COPY
+    bulk_batch_size = 10000
+
+    # The set-based merge done by --bulk, in order.  Each statement is paired
+    # with the statistic its rowcount is added to, so the report matches the
+    # one produced by the row-at-a-time import.
+    bulk_merge_sql = [
+        (None, "ANALYZE import_packages_tmp"),
+        (None, "ANALYZE import_descriptions_tmp"),
+        (None, "ANALYZE import_parts_tmp"),
+        # Cheap test to ensure the database contents are OK
+        (None, """UPDATE description_tb SET description = d.description
+                     FROM import_descriptions_tmp d
+                    WHERE description_tb.description_md5 = d.description_md5
+                      AND description_tb.description <> d.description"""),
+        ('new-descr', """INSERT INTO description_tb (description_md5, description, package, source)
+                          SELECT d.description_md5, d.description, d.package, d.source
+                            FROM import_descriptions_tmp d
+                           WHERE NOT EXISTS (SELECT 1 FROM description_tb t
+                                              WHERE t.description_md5 = d.description_md5)"""),
+        (None, """UPDATE import_descriptions_tmp d SET description_id = t.description_id
+                     FROM description_tb t
+                    WHERE t.description_md5 = d.description_md5"""),
+        ('upd-tag', """UPDATE description_tag_tb SET date_end = :today
+                         FROM import_descriptions_tmp d
+                        WHERE description_tag_tb.description_id = d.description_id
+                          AND description_tag_tb.tag = :tag
+                          AND description_tag_tb.date_end < :today"""),
+        ('new-tag', """INSERT INTO description_tag_tb (description_id, tag, date_begin, date_end)
+                        SELECT d.description_id, :tag, :today, :today
+                          FROM import_descriptions_tmp d
+                         WHERE NOT EXISTS (SELECT 1 FROM description_tag_tb t
+                                            WHERE t.description_id = d.description_id
+                                              AND t.tag = :tag)"""),
+        (None, """UPDATE package_version_tb SET source = p.source
+                     FROM import_packages_tmp p
+                     JOIN import_descriptions_tmp d ON d.description_md5 = p.description_md5
+                    WHERE package_version_tb.description_id = d.description_id
+                      AND package_version_tb.package = p.package
+                      AND package_version_tb.version = p.version
+                      AND package_version_tb.source IS DISTINCT FROM p.source"""),
+        ('new-package_version', """INSERT INTO package_version_tb (package, version, description_id, source)
+                                    SELECT DISTINCT ON (d.description_id, p.package, p.version)
+                                           p.package, p.version, d.description_id, p.source
+                                      FROM import_packages_tmp p
+                                      JOIN import_descriptions_tmp d ON d.description_md5 = p.description_md5
+                                     WHERE NOT EXISTS (SELECT 1 FROM package_version_tb v
+                                                        WHERE v.description_id = d.description_id
+                                                          AND v.package = p.package
+                                                          AND v.version = p.version)"""),
+        ('new-part', """INSERT INTO part_description_tb (description_id, part_md5)
+                         SELECT DISTINCT d.description_id, p.part_md5
+                           FROM import_parts_tmp p
+                           JOIN import_descriptions_tmp d ON d.description_md5 = p.description_md5
+                          WHERE NOT EXISTS (SELECT 1 FROM part_description_tb t
+                                             WHERE t.description_id = d.description_id
+                                               AND t.part_md5 = p.part_md5)"""),
+    ]
+
     def _open(self, filename):
-        if filename.endswith('.bz2'):
-            f = subprocess.Popen(['bzcat', filename], stdout=subprocess.PIPE)
-            return f.stdout
-        if filename.endswith('.gz'):
-            f = subprocess.Popen(['zcat', filename], stdout=subprocess.PIPE)
-            return f.stdout
-        f = open(filename, "r")
-        return f
+        return compressed.open_compressed(filename)
+
+    def _parse_serial(self, filenames):
+        """ Yields (filename, paragraphs) for each file, parsing as we go """
+        for file in filenames:
+            f = self.profile.iterate(self._open(file), 'decompress')
+            yield file, self.profile.iterate(paragraphs.iter_paragraphs(f, IMPORT_FIELDS), 'parse')
+
+    def _parse_parallel(self, filenames, jobs):
+        """ Like _parse_serial(), but parses the files in a pool of worker
+        processes.  The workers are started straight away.  The pooled
+        database connections are closed first so the workers don't inherit
+        them, which means a caller like import_mirror must not have a
+        session open at this point. """
+        db.dispose()
+        pool = multiprocessing.Pool(jobs)
+        if isinstance(self.descr_text_map, DiskTextMap):
+            text_dir = self.descr_text_map.dir
+        else:
+            text_dir = None
+        results = self._imap_bounded(pool, filenames, text_dir, jobs)
+        return self._merge_parsed(pool, filenames, results)
+
+    def _imap_bounded(self, pool, filenames, text_dir, backlog):
+        """ Like pool.imap(), but with no more than backlog files handed to
+        the workers beyond the one being merged.  Otherwise the workers run
+        ahead and every parsed file ends up waiting in memory.  The first
+        files are handed out straight away. """
+        filenames = iter(filenames)
+        pending = deque(pool.apply_async(parse_packages_file, (filename, text_dir))
+                        for filename in itertools.islice(filenames, backlog))
+
+        def results():
+            while pending:
+                result = pending.popleft().get()
+                for filename in itertools.islice(filenames, 1):
+                    pending.append(pool.apply_async(parse_packages_file, (filename, text_dir)))
+                yield result
+        return results()
+
+    def _merge_parsed(self, pool, filenames, results):
+        """ Yields (filename, paragraphs) from the worker results in order.
+        Descriptions are put straight into the text map and package
+        paragraphs already seen in an earlier file are dropped, so the
+        writer only sees each (md5, package, version) once. """
+        seen = set()
+        # Decompressing, parsing and hashing happen in the workers, what we
+        # see here is the time spent waiting for them.
+        results = self.profile.iterate(results, 'parse')
+        try:
+            for file, (texts, paras, count) in itertools.izip(filenames, results):
+                if isinstance(self.descr_text_map, DiskTextMap):
+                    ntexts = self.descr_text_map.merge(texts)
+                else:
+                    ntexts = len(texts)
+                    self.descr_text_map.update(texts)
+                self.profile.add_rows('parse', ntexts + count - 1)
+                new_paras = [para for key, para in paras if key not in seen]
+                seen.update(key for key, para in paras)
+                # Skipped duplicates still count as processed
+                self.stats['count-descr'] += count - len(new_paras)
+                yield file, new_paras
+        finally:
+            pool.terminate()
 
     def handle(self, *args, **options):
         if not args:
@@ -54,30 +433,83 @@ class Command(BaseCommand):
         if not tag.isalpha() or not tag.islower():
             raise CommandError("First argument must be tag, e.g. sid, wheezy, squeeze, etc...")
 
+        if options.get('low_memory'):
+            self.descr_text_map = DiskTextMap()
+        else:
+            self.descr_text_map = {}
+        self.descr_seen = set()
+        self.stats = defaultdict(int)
+        if options.get('profile'):
+            self.profile = ImportProfile()
+        else:
+            self.profile = NullProfile()
+
+        # Start the workers before we have any database connection to share
+        jobs = options.get('jobs') or 1
+        if jobs > 1:
+            files = self._parse_parallel(filenames, jobs)
+        else:
+            files = self._parse_serial(filenames)
+
         self.session = db.get_db_session()
 #        self.session.bind.echo=False
 
-        self.descr_text_map = {}
-        self.descr_map = {}
-        self.stats = defaultdict(int)
+        bulk = options.get('bulk')
+        if bulk:
+            self._start_bulk()
+        else:
+            with self.profile.phase('lookup', 0):
+                self.descr_index = DescriptionIndex(self.session)
+            self.tag_descr_ids = set()
+            self.check_texts = []
 
-        for file in filenames:
+        try:
+            self._import_files(tag, files, bulk)
+        finally:
+            if options.get('low_memory'):
+                self.descr_text_map.close()
+
+        self.stdout.write("Processed descriptions %d, unique %d, new %d\n" %
+                          (self.stats['count-descr'], self.stats['fetch-descr'], self.stats['new-descr']))
+        self.stdout.write("New tags %d, updated tags %d, new package versions %d, new parts %d\n" %
+                          (self.stats['new-tag'], self.stats['upd-tag'], self.stats['new-package_version'], self.stats['new-part']))
+        if options.get('profile'):
+            self.profile.report(self.stdout)
+            self.stdout.write("Description parts cache: %(hits)d hits, %(misses)d misses, %(size)d entries\n" %
+                              ddtp.description_parts_cache.stats())
+
+    def _import_files(self, tag, files, bulk):
+        """ Merges the paragraphs of the (filename, paragraphs) pairs into
+        the database """
+        for file, paras in files:
             self.stderr.write('Processing %s\n' % file)
-            f = self._open(file)
-            for para in Deb822.iter_paragraphs(f):
+            for para in paras:
                 if 'Description-en' in para:
                     self._handle_translation_en(para)
                 if 'Version' in para:
                     try:
-                        self._handle_packages(tag, para)
+                        if bulk:
+                            self._stage_packages(tag, para)
+                        else:
+                            self._handle_packages(tag, para)
                     except Exception, e:
                         self.stdout.write("Problem processing %r\n%s\n" % (para, e))
-            self.session.commit()
+            if bulk:
+                self._flush_bulk()
+            else:
+                self._check_texts()
+                with self.profile.phase('commit'):
+                    self.session.commit()
 
-        self.stdout.write("Processed descriptions %d, unique %d, new %d\n" %
-                          (self.stats['count-descr'], self.stats['fetch-descr'], self.stats['new-descr']))
-        self.stdout.write("New tags %d, updated tags %d, new package versions %d, new parts %d\n" %
-                          (self.stats['new-tag'], self.stats['upd-tag'], self.stats['new-package_version'], self.stats['new-part']))
+        with self.profile.phase('merge'):
+            if bulk:
+                self._merge_bulk(tag)
+            else:
+                self._update_tags(tag)
+            # New descriptions may go before the queued ones
+            ddtss.TranslationQueue.invalidate(self.session)
+        with self.profile.phase('commit'):
+            self.session.commit()
 
     def _handle_translation_en(self, para):
         """ para is the paragraph in the Translation-en file """
@@ -85,12 +517,13 @@ class Command(BaseCommand):
         md5 = para['Description-md5']
         text = para['Description-en'] + "\n"
 
-        assert md5 == hashlib.md5(text.encode('utf-8')).hexdigest()
+        with self.profile.phase('hash'):
+            assert md5 == hashlib.md5(text.encode('utf-8')).hexdigest()
 
         self.descr_text_map[md5] = text
 
-    def _handle_packages(self, tag, para):
-        """ Take a packages paragraph and merges it with the database. Tag is sid, wheezy, etc """
+    def _get_description(self, para):
+        """ Returns the (md5, text) of the description of a packages paragraph """
         if 'Description-md5' in para:
             # New style
             md5 = para['Description-md5']
@@ -99,66 +532,171 @@ class Command(BaseCommand):
                 raise CommandError("Couldn't find description for md5 %s, did you provide the correct Translations-en file?" % md5)
         else:
             text = para['Description'] + "\n"
-            md5 = hashlib.md5(text.encode('utf-8')).hexdigest()
+            with self.profile.phase('hash'):
+                md5 = hashlib.md5(text.encode('utf-8')).hexdigest()
+
+        return md5, text
+
+    def _start_bulk(self):
+        """ Creates the staging tables used by --bulk. They are dropped on commit """
+        for table, columns, create_sql in self.bulk_tables:
+            self.session.execute(create_sql)
+
+        self.bulk_rows = defaultdict(list)
+
+    def _stage_packages(self, tag, para):
+        """ Take a packages paragraph and queues it for the staging tables.
+        Parts are only split out once for each unique description """
+        md5, text = self._get_description(para)
+
+        package = para['Package']
+        source = para.get('Source', package)  # Source defaults to Package
+        version = para['Version']
 
         self.stats['count-descr'] += 1
-        description = self.descr_map.get(md5)
-        if not description:
-            description=self.session.query(ddtp.Description).filter(ddtp.Description.description_md5==md5).first()
+        self.bulk_rows['import_packages_tmp'].append((package, source, version, md5))
+
+        if md5 not in self.descr_seen:
+            self.descr_seen.add(md5)
+            self.stats['fetch-descr'] += 1
+            self.bulk_rows['import_descriptions_tmp'].append((md5, text, package, source))
+            with self.profile.phase('hash'):
+                parts = ddtp.get_description_parts(md5, text)
+            for part, part_md5 in parts:
+                self.bulk_rows['import_parts_tmp'].append((md5, part_md5))
+
+        if len(self.bulk_rows['import_packages_tmp']) >= self.bulk_batch_size:
+            self._flush_bulk()
+
+    def _flush_bulk(self):
+        """ Sends the queued rows to the staging tables using COPY """
+        cursor = self.session.connection().connection.cursor()
+        for table, columns, create_sql in self.bulk_tables:
+            rows = self.bulk_rows[table]
+            if not rows:
+                continue
+            with self.profile.phase('flush', len(rows)):
+                buf = StringIO()
+                for row in rows:
+                    buf.write(u"\t".join(copy_escape(v) for v in row).encode('utf-8'))
+                    buf.write("\n")
+                buf.seek(0)
+                cursor.copy_from(buf, table, columns=columns)
+            del rows[:]
+
+    def _merge_bulk(self, tag):
+        """ Merges the staging tables into the database """
+        params = dict(tag=tag, today=date.today())
+        for stat, sql in self.bulk_merge_sql:
+            result = self.session.execute(sql, params)
+            if stat:
+                self.stats[stat] += result.rowcount
+
+    def _check_texts(self):
+        """ Corrects the text of existing descriptions that differs from
+        the one imported, for the queued (description_id, text) pairs """
+        if not self.check_texts:
+            return
+        ids, texts = zip(*self.check_texts)
+        with self.profile.phase('flush', len(ids)):
+            self.session.execute("""UPDATE description_tb SET description = v.description
+                                      FROM (SELECT unnest(CAST(:ids AS integer[])) AS description_id,
+                                                   unnest(CAST(:texts AS text[])) AS description) v
+                                     WHERE description_tb.description_id = v.description_id
+                                       AND description_tb.description <> v.description""",
+                                 dict(ids=list(ids), texts=list(texts)))
+        del self.check_texts[:]
+
+    def _update_tags(self, tag):
+        """ Every description seen in this import gets the same date_end for
+        the tag, so do it with one UPDATE and add the missing tags with one
+        INSERT.  The ids are passed as an array. """
+        params = dict(tag=tag, today=date.today(), ids=list(self.tag_descr_ids))
+        result = self.session.execute("""UPDATE description_tag_tb SET date_end = :today
+                                         WHERE description_id = ANY(CAST(:ids AS integer[]))
+                                           AND tag = :tag
+                                           AND date_end < :today""", params)
+        self.stats['upd-tag'] += result.rowcount
+        result = self.session.execute("""INSERT INTO description_tag_tb (description_id, tag, date_begin, date_end)
+                                        SELECT i.description_id, :tag, :today, :today
+                                          FROM unnest(CAST(:ids AS integer[])) AS i(description_id)
+                                         WHERE NOT EXISTS (SELECT 1 FROM description_tag_tb t
+                                                            WHERE t.description_id = i.description_id
+                                                              AND t.tag = :tag)""", params)
+        self.stats['new-tag'] += result.rowcount
+
+    def _handle_packages(self, tag, para):
+        """ Take a packages paragraph and merges it with the database. Tag is sid, wheezy, etc """
+        md5, text = self._get_description(para)
+
+        self.stats['count-descr'] += 1
+        first_seen = md5 not in self.descr_seen
+        if first_seen:
+            self.descr_seen.add(md5)
             self.stats['fetch-descr'] += 1
 
         package = para['Package']
         source = para.get('Source', package)  # Source defaults to Package
         version = para['Version']
 
-        if not description:
+        # Existing descriptions are only known by id, the md5 guarantees
+        # the text is the same.
+        with self.profile.phase('lookup'):
+            description_id = self.descr_index.get(md5)
+        new_description = description_id is None
+        if new_description:
             # New description, everything new
             description = ddtp.Description(description_md5=md5,
                                            description=text,
                                            package=package,   # These fields will go
                                            source=source)     # away eventually
             self.session.add(description)
+            with self.profile.phase('flush'):
+                self.session.flush()
+            description_id = description.description_id
+            self.descr_index.add(md5, description_id)
             self.stats['new-descr'] += 1
-        else:
-            # Cheap test to enusre the database contents are OK
-            if description.description != text:
-                description.description = text
-
-        self.descr_map[md5] = description
-
-        # update Tags
-        tag_obj = description.has_tag(tag)
-        if tag_obj:
-            if tag_obj.date_end < date.today():
-                tag_obj.date_end = date.today()
-                self.stats['upd-tag'] += 1
-        else:
-            description_tag = ddtp.DescriptionTag(tag=tag,
-                                                  description=description,
-                                                  date_begin=date.today(),
-                                                  date_end=date.today())
-            self.session.add(description_tag)
-            self.stats['new-tag'] += 1
+        elif first_seen:
+            # Cheap test to ensure the database contents are OK, done in
+            # batches like the --bulk merge does
+            self.check_texts.append((description_id, text))
+            if len(self.check_texts) >= self.bulk_batch_size:
+                self._check_texts()
+
+        # Tags are updated in one go at the end
+        self.tag_descr_ids.add(description_id)
 
         # add PackageVersions
-        package_version = description.has_package_version(package, version)
+        with self.profile.phase('lookup'):
+            package_version = self.session.query(ddtp.PackageVersion). \
+                                           filter_by(package=package, version=version, description_id=description_id). \
+                                           first()
         if package_version:
             package_version.source = source
         else:
             package_version = ddtp.PackageVersion(package=package,
                                                   version=version,
-                                                  description=description,
+                                                  description_id=description_id,
                                                   source=source)
             self.session.add(package_version)
             self.stats['new-package_version'] += 1
 
-        # add Parts
-        parts_list = description.get_description_part_objects()
-        for part_text, part_md5, part_obj in parts_list:
-            if not part_obj:
-                part_obj = ddtp.PartDescription(part_md5=part_md5)
-                part_obj.description = description
-                self.session.add(part_obj)
-                self.stats['new-part'] += 1
+        # add Parts, only needed the first time we see a description
+        if first_seen:
+            if new_description:
+                existing_parts = set()
+            else:
+                with self.profile.phase('lookup'):
+                    existing_parts = set(part_md5 for part_md5, in
+                                         self.session.query(ddtp.PartDescription.part_md5).
+                                                      filter_by(description_id=description_id))
+            with self.profile.phase('hash'):
+                parts = ddtp.get_description_parts(md5, text)
+            for part, part_md5 in parts:
+                if part_md5 not in existing_parts:
+                    existing_parts.add(part_md5)
+                    self.session.add(ddtp.PartDescription(description_id=description_id, part_md5=part_md5))
+                    self.stats['new-part'] += 1
 
-        self.session.flush()
+        with self.profile.phase('flush'):
+            self.session.flush()
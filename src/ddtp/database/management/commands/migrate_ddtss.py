@@ -264,5 +264,8 @@ class Command(NoArgsCommand):
             except Exception, e:
                 print "Package %r: %s" % (package_key, e)
 
+        # Recounted when next needed
+        ddtss.TranslationCounts.invalidate(session)
+
         session.commit()
         print "Done."
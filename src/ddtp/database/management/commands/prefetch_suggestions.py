@@ -0,0 +1,119 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtss
+from ddtp.database.ddtp import Description
+
+class Command(BaseCommand):
+    """ Keeps the suggestions for the next descriptions of every queue
+    precomputed, so fetching one doesn't wait for make_suggestion().  Run
+    it from cron, or with --loop as a daemon; several may run at once. """
+
+    help = "Precomputes suggestions for the descriptions to translate next"
+    args = "[lang ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--size', type='int', default=ddtss.PrefetchedSuggestion.PREFETCH_SIZE,
+                    help='Descriptions per language to prefetch (default %d)' % ddtss.PrefetchedSuggestion.PREFETCH_SIZE),
+        make_option('--loop', type='int', default=0, metavar='SECONDS',
+                    help='Keep running, sleeping this long between passes'),
+        make_option('--report', type='int', default=0, metavar='DAYS',
+                    help='Only report the hit ratio and time saved over the last days'),
+    )
+
+    requires_model_validation = False
+
+    # Fetch log entries older than this many days are removed
+    LOG_DAYS = 30
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        langs = [lang for lang, in session.query(ddtss.Languages.language).
+                                           filter(ddtss.Languages.enabled_ddtss == True).
+                                           order_by(ddtss.Languages.language)]
+        if args:
+            unknown = set(args) - set(langs)
+            if unknown:
+                raise CommandError("Unknown or disabled languages: %s" % ", ".join(sorted(unknown)))
+            langs = list(args)
+        session.close()
+
+        if options['report']:
+            self.report(langs, options['report'])
+            return
+
+        while True:
+            computed = self.prefetch(langs, options['size'])
+            if int(options['verbosity']) >= 1:
+                self.stdout.write("Computed %d suggestions\n" % computed)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def prefetch(self, langs, size):
+        """ One pass over the languages, returns the number of suggestions made """
+        session = db.get_db_session()
+        count = 0
+        for lang in langs:
+            ddtss.PrefetchedSuggestion.enqueue(session, lang, size)
+            session.commit()
+
+            while True:
+                description_id = ddtss.PrefetchedSuggestion.claim(session, lang)
+                if description_id is None:
+                    break
+                description = session.query(Description).get(description_id)
+                start = time.time()
+                short, long = ddtss.PendingTranslation.make_suggestion(description, lang)
+                ddtss.PrefetchedSuggestion.store(session, lang, description_id, short, long, time.time() - start)
+                # Releases the claim
+                session.commit()
+                session.expunge_all()
+                count += 1
+
+        session.execute("""DELETE FROM prefetchedsuggestionlog_tb WHERE "timestamp" < :before""",
+                        dict(before=int(time.time()) - self.LOG_DAYS * 86400))
+        session.commit()
+        session.close()
+        return count
+
+    def report(self, langs, days):
+        session = db.get_db_session()
+        rows = session.execute("""SELECT language, count(*),
+                                         sum(CASE WHEN hit THEN 1 ELSE 0 END),
+                                         sum(CASE WHEN hit THEN duration ELSE 0 END),
+                                         avg(CASE WHEN hit THEN NULL ELSE duration END)
+                                    FROM prefetchedsuggestionlog_tb
+                                   WHERE "timestamp" >= :since
+                                   GROUP BY language
+                                   ORDER BY language""",
+                               dict(since=int(time.time()) - days * 86400))
+        self.stdout.write("Suggestions over the last %d days:\n" % days)
+        for lang, fetches, hits, saved, inline in rows:
+            if lang not in langs:
+                continue
+            self.stdout.write("  %s: %d fetches, %d prefetched (%.1f%%), %.1fs saved, %.0fms per inline suggestion\n" %
+                              (lang, fetches, hits, 100.0 * hits / fetches, saved, 1000 * (inline or 0)))
+        session.close()
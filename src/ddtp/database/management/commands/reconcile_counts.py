@@ -0,0 +1,69 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtss
+
+class Command(BaseCommand):
+    """ translationcounts_tb is maintained incrementally.  This compares it
+    with the actual counts, reports any drift and repairs it. """
+
+    help = "Checks and repairs the per-language translation counters"
+    args = "[lang ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report the drift, don\'t repair it'),
+    )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        langs = [lang for lang, in session.query(ddtss.Languages.language).order_by(ddtss.Languages.language)]
+        if args:
+            unknown = set(args) - set(langs)
+            if unknown:
+                raise CommandError("Unknown languages: %s" % ", ".join(sorted(unknown)))
+            langs = list(args)
+
+        drifted = 0
+        for lang in langs:
+            stored = session.query(ddtss.TranslationCounts).get(lang)
+            actual = ddtss.TranslationCounts.count(session, lang)
+            if stored is None:
+                self.stdout.write("%s: no counters\n" % lang)
+            else:
+                diffs = ["%s %d, actual %d" % (column, getattr(stored, column), actual[column])
+                         for column in ddtss.TranslationCounts.COLUMNS
+                         if getattr(stored, column) != actual[column]]
+                if not diffs:
+                    continue
+                self.stdout.write("%s: %s\n" % (lang, "; ".join(diffs)))
+            drifted += 1
+
+            if not options['dry_run']:
+                ddtss.TranslationCounts.reconcile(session, lang)
+                session.commit()
+
+        self.stdout.write("%d of %d languages %s\n" % (drifted, len(langs), "drifted" if options['dry_run'] else "repaired"))
@@ -0,0 +1,48 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from ddtp.database import db, ddtp, ddtss
+
+class Command(BaseCommand):
+    """ Maintains active_tb, the descriptions that have been seen in a
+    recent import. Only descriptions whose tags changed since the previous
+    run are looked at, see ActiveDescription.refresh(). """
+
+    help = "Updates the list of active descriptions after an import"
+    args = ""
+
+    requires_model_validation = False
+
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Rebuild the whole table instead of only looking at changed descriptions'),
+    )
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        inserted, removed = ddtp.ActiveDescription.refresh(session, full=options.get('full'))
+        if inserted or removed:
+            ddtss.TranslationCounts.refresh_active(session)
+        session.commit()
+
+        self.stdout.write("Active descriptions: inserted %d, removed %d\n" % (inserted, removed))
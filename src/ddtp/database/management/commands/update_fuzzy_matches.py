@@ -0,0 +1,192 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from optparse import make_option
+from sqlalchemy import text
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtp, ddtss, fuzzy
+
+class Command(BaseCommand):
+    """ Fills fuzzy_match_tb, so the DDTSS can suggest fuzzy matches with a
+    lookup instead of computing them while the translator waits.  Only the
+    untranslated parts of active descriptions without an entry yet are
+    matched, so after an import this only looks at the new parts.  Entries
+    that are no longer needed are removed.  Existing entries are compared
+    with the parts translated since they were matched, and updated if one
+    of those is closer.  The index of all translated parts of a language is
+    kept in DDTP_FUZZY_INDEX_DIR, so a run after an import only has to add
+    the parts translated since the last one. """
+
+    help = "Precomputes the fuzzy matches for untranslated parts"
+    args = "[lang ...]"
+
+    requires_model_validation = False
+
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='Recompute all matches and indexes instead of only the missing ones'),
+    )
+
+    # Number of rows inserted per statement
+    batch_size = 1000
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        langs = [lang for lang, in session.query(ddtss.Languages.language).
+                                           filter(ddtss.Languages.enabled_ddtss == True).
+                                           order_by(ddtss.Languages.language)]
+        if args:
+            unknown = set(args) - set(langs)
+            if unknown:
+                raise CommandError("Unknown or disabled languages: %s" % ", ".join(sorted(unknown)))
+            langs = list(args)
+
+        for lang in langs:
+            removed = self._remove_obsolete(session, lang, options.get('full'))
+            last_part_id = session.execute("SELECT max(part_id) FROM part_tb WHERE language = :lang",
+                                           dict(lang=lang)).scalar() or 0
+            improved = self._rematch(session, lang, last_part_id)
+            added, matched = self._add_missing(session, lang, last_part_id, options.get('full'))
+            session.commit()
+            self.stdout.write("%s: removed %d, improved %d, added %d, with a match %d\n" % (lang, removed, improved, added, matched))
+
+    def _remove_obsolete(self, session, lang, full):
+        """ Removes the entries of parts that have been translated or are no
+        longer in an active description, or all of them if full """
+        params = dict(lang=lang)
+        if full:
+            return session.execute("DELETE FROM fuzzy_match_tb WHERE language = :lang", params).rowcount
+        return session.execute("""DELETE FROM fuzzy_match_tb f
+                                   WHERE f.language = :lang
+                                     AND (EXISTS (SELECT 1 FROM part_tb t
+                                                   WHERE t.part_md5 = f.part_md5
+                                                     AND t.language = f.language)
+                                          OR NOT EXISTS (SELECT 1 FROM part_description_tb pd
+                                                           JOIN active_tb a ON a.description_id = pd.description_id
+                                                          WHERE pd.part_md5 = f.part_md5))""", params).rowcount
+
+    def _rematch(self, session, lang, last_part_id):
+        """ Compares the entries matched before last_part_id with the parts
+        translated since, and stores the closer ones.  Returns the number of
+        entries that got a better match. """
+        params = dict(lang=lang, last_part_id=last_part_id)
+        first_part_id = session.execute("""SELECT min(last_part_id) FROM fuzzy_match_tb
+                                            WHERE language = :lang""", params).scalar()
+        if first_part_id is None or first_part_id >= last_part_id:
+            return 0
+
+        # Usually only a day's worth of translations, so this is cheap
+        index = fuzzy.build_language_index(session, lang, after_part_id=first_part_id)
+
+        improved = 0
+        if len(index):
+            stale_sql = """SELECT f.part_md5, f.ratio FROM fuzzy_match_tb f
+                            WHERE f.language = :lang
+                              AND f.last_part_id < :last_part_id"""
+            stale = dict((part_md5, ratio) for part_md5, ratio in session.execute(stale_sql, params))
+
+            rows = []
+            descriptions = session.connection().execution_options(stream_results=True). \
+                                   execute(text("""SELECT d.description_md5, d.description FROM description_tb d
+                                                    WHERE d.description_id IN (SELECT pd.description_id
+                                                                                 FROM part_description_tb pd
+                                                                                 JOIN (%s) s ON s.part_md5 = pd.part_md5)""" % stale_sql),
+                                           params)
+            for description_md5, description in descriptions:
+                for part, part_md5 in ddtp.get_description_parts(description_md5, description):
+                    if part_md5 not in stale:
+                        continue
+                    ratio = stale.pop(part_md5)
+
+                    match = index.closest(part)
+                    if match and (ratio is None or match[0] > ratio):
+                        rows.append(dict(part_md5=part_md5, lang=lang, match_md5=match[1], ratio=match[0]))
+                        improved += 1
+
+                    if len(rows) >= self.batch_size:
+                        self._update_matches(session, rows)
+                        rows = []
+            if rows:
+                self._update_matches(session, rows)
+
+        session.execute("""UPDATE fuzzy_match_tb SET last_part_id = :last_part_id
+                            WHERE language = :lang
+                              AND last_part_id < :last_part_id""", params)
+        return improved
+
+    def _update_matches(self, session, rows):
+        session.execute("""UPDATE fuzzy_match_tb SET match_md5 = :match_md5, ratio = :ratio
+                            WHERE part_md5 = :part_md5 AND language = :lang""", rows)
+
+    def _add_missing(self, session, lang, last_part_id, full):
+        """ Matches the untranslated parts of active descriptions that have
+        no entry yet.  Returns the number of entries added and how many of
+        them have a match.  With full the saved index is not used. """
+        params = dict(lang=lang)
+        missing_sql = """SELECT pd.description_id, pd.part_md5
+                           FROM part_description_tb pd
+                           JOIN active_tb a ON a.description_id = pd.description_id
+                          WHERE NOT EXISTS (SELECT 1 FROM part_tb t
+                                             WHERE t.part_md5 = pd.part_md5
+                                               AND t.language = :lang)
+                            AND NOT EXISTS (SELECT 1 FROM fuzzy_match_tb f
+                                             WHERE f.part_md5 = pd.part_md5
+                                               AND f.language = :lang)"""
+        missing = set(part_md5 for description_id, part_md5 in session.execute(missing_sql, params))
+        if not missing:
+            return 0, 0
+
+        # Only get the index when there is something to match, it's the
+        # expensive bit
+        if settings.DDTP_FUZZY_INDEX_DIR:
+            index = fuzzy.load_language_index(session, lang, settings.DDTP_FUZZY_INDEX_DIR, rebuild=full)
+        else:
+            index = fuzzy.build_language_index(session, lang)
+
+        rows = []
+        added = matched = 0
+        descriptions = session.connection().execution_options(stream_results=True). \
+                               execute(text("""SELECT d.description_md5, d.description FROM description_tb d
+                                                WHERE d.description_id IN (SELECT m.description_id FROM (%s) m)""" % missing_sql),
+                                       params)
+        for description_md5, description in descriptions:
+            for part, part_md5 in ddtp.get_description_parts(description_md5, description):
+                if part_md5 not in missing:
+                    continue
+                missing.discard(part_md5)
+
+                match = index.closest(part)
+                if match:
+                    ratio, match_md5 = match
+                    matched += 1
+                else:
+                    ratio, match_md5 = None, None
+                rows.append(dict(part_md5=part_md5, language=lang, match_md5=match_md5, ratio=ratio,
+                                 last_part_id=last_part_id))
+                added += 1
+
+                if len(rows) >= self.batch_size:
+                    session.execute(ddtp.FuzzyMatch.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            session.execute(ddtp.FuzzyMatch.__table__.insert(), rows)
+        return added, matched
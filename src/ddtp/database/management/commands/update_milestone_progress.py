@@ -0,0 +1,51 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+
+from django.core.management.base import BaseCommand
+
+from ddtp.database import db, ddtp, ddtss
+
+class Command(BaseCommand):
+    """ milestoneprogress_tb is only adjusted for translations and pending
+    translations.  When description_milestone_tb is rebuilt this recounts
+    the affected milestones for every language. """
+
+    help = "Recounts the per-language milestone progress"
+    args = "[milestone ...]"
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        ddtp.MilestoneProgress.invalidate(session, args or None)
+
+        langs = [lang for lang, in session.query(ddtss.Languages.language).order_by(ddtss.Languages.language)]
+        for lang in langs:
+            if args:
+                for milestone in args:
+                    ddtp.MilestoneProgress.count(session, lang, milestone)
+            else:
+                ddtp.MilestoneProgress.count(session, lang)
+
+        session.commit()
+
+        rows = session.query(ddtp.MilestoneProgress).count()
+        self.stdout.write("Counted %d languages, %d milestone rows\n" % (len(langs), rows))
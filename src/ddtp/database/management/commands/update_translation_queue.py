@@ -0,0 +1,49 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ddtp.database import db, ddtss
+
+class Command(BaseCommand):
+    """ The translation queues are emptied by imports and milestone changes
+    in the DDTSS and refilled on demand.  When description_milestone_tb is
+    updated from outside, run this to refill them straight away. """
+
+    help = "Refills the queues of descriptions to translate next"
+    args = "[lang ...]"
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        session = db.get_db_session()
+
+        langs = [lang for lang, in session.query(ddtss.Languages.language).
+                                           filter(ddtss.Languages.enabled_ddtss == True).
+                                           order_by(ddtss.Languages.language)]
+        if args:
+            unknown = set(args) - set(langs)
+            if unknown:
+                raise CommandError("Unknown or disabled languages: %s" % ", ".join(sorted(unknown)))
+            langs = list(args)
+
+        for lang in langs:
+            ddtss.TranslationQueue.refill(session, lang)
+            session.commit()
+            self.stdout.write("Refilled queue for %s\n" % lang)
@@ -0,0 +1,103 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+# A streaming replacement for debian.deb822 for the files we read in bulk
+# (Packages, Translation-*).  Deb822 builds a full case insensitive ordered
+# mapping for every paragraph, while the import only needs a handful of
+# fields.  The parsing rules follow Deb822._internal_parser, so the values
+# come out identical: the first line of a value is stripped, continuation
+# lines are appended verbatim after a newline, and lines that aren't a
+# field or a continuation are ignored.
+
+def _decode(s, encoding):
+    """ Decode like Deb822 does, falling back to latin-1 for broken files """
+    try:
+        return s.decode(encoding)
+    except UnicodeDecodeError:
+        return s.decode('latin-1')
+
+def iter_paragraphs(f, fields=None, encoding='utf-8'):
+    """ Yields a dict per paragraph of the file (or other sequence of
+    lines) f, containing only the given fields.  Field names are matched
+    case insensitively, as with Deb822, and the dict uses the spelling
+    given in fields.  With fields None all fields are returned under the
+    name used in the file.  Paragraphs with none of the fields are skipped. """
+    if fields is not None:
+        wanted = dict((field.lower(), field) for field in fields)
+
+    para = {}
+    key = None
+    content = None
+    for line in f:
+        line = line.strip('\r\n')
+
+        # Blank, or whitespace only, lines separate paragraphs
+        if not line.strip():
+            if key is not None:
+                para[key] = content
+                key = None
+            if para:
+                yield para
+                para = {}
+            continue
+
+        # Continuation line, kept as is including the leading space
+        if line[0] in ' \t':
+            if key is not None:
+                content += u'\n' + _decode(line, encoding)
+            continue
+
+        # Comment lines are skipped, also between continuation lines, like
+        # Deb822 does
+        if line[0] == '#':
+            continue
+
+        colon = line.find(':')
+        if colon <= 0:
+            continue
+        name = line[:colon].rstrip()
+        if ' ' in name or '\t' in name:
+            continue
+
+        if key is not None:
+            para[key] = content
+
+        if fields is None:
+            key = name
+        else:
+            key = wanted.get(name.lower())
+            if key is None:
+                continue
+        content = _decode(line[colon+1:], encoding).strip()
+
+    if key is not None:
+        para[key] = content
+    if para:
+        yield para
+
+def dump_paragraph(fields):
+    """ Formats a list of (field, value) pairs as a paragraph, the same way
+    Deb822.dump() does.  Returns a unicode string. """
+    result = []
+    for field, value in fields:
+        if not value or value[0] == u'\n':
+            result.append(u'%s:%s\n' % (field, value))
+        else:
+            result.append(u'%s: %s\n' % (field, value))
+    return u''.join(result)
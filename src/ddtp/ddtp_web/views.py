@@ -22,9 +22,9 @@ from django.http import HttpResponse, Http404
 from django.template import RequestContext
 from django.views.decorators.cache import cache_page
 from ddtp.database.db import with_db_session
-from ddtp.database.ddtp import Description, PackageVersion, DescriptionTag, ActiveDescription, Translation, DescriptionMilestone, Part, PartDescription
-from ddtp.database.ddtss import PendingTranslation, Languages
-from sqlalchemy import func
+from ddtp.database.ddtp import Description, PackageVersion, DescriptionTag, ActiveDescription, Translation, DescriptionMilestone, Part, PartDescription, \
+    Statistic, MilestoneProgress
+from ddtp.database.ddtss import PendingTranslation, Languages, TranslationCounts
 from sqlalchemy.orm import subqueryload
 from ddtp.ddtss.views import get_user
 
@@ -64,13 +64,15 @@ def view_browse(session, request, prefix):
 def view_index(session, request):
     """ Main index.html, main page """
 
-    langinfo = session.query(Languages, func.count(Translation.translation_id), func.count(ActiveDescription.description_id)). \
-                             outerjoin(Translation, Translation.language == Languages.language). \
-                             outerjoin(ActiveDescription, ActiveDescription.description_id == Translation.description_id). \
-                             group_by(Languages). \
-                             order_by(Languages.language).all()
+    counts = TranslationCounts.get_all(session)
+    session.commit()
+    langinfo = [(lang, counts[lang.language].translated, counts[lang.language].active_translated)
+                for lang in session.query(Languages).order_by(Languages.language)]
 
-    active = session.query(ActiveDescription).count()
+    # Recorded by update_active
+    active = session.query(Statistic.value).filter(Statistic.stat == 'active'). \
+                     order_by(Statistic.date.desc()).first()
+    active = active[0] if active else session.query(ActiveDescription).count()
     descriptions = session.query(Description).count()
     return render_to_response("index.html", {'langinfo': langinfo, 'active_count': active, 'description_count': descriptions}, context_instance=RequestContext(request))
 
@@ -235,25 +237,14 @@ def stats_milestones_lang(session, request, language):
     if not lang:
         raise Http404()
 
-    resultset = session.query(DescriptionMilestone.milestone,func.count(Translation.description_id)). \
-                        join(Translation, DescriptionMilestone.description_id == Translation.description_id).\
-                        filter(Translation.language==language).\
-                        group_by(DescriptionMilestone.milestone).order_by(DescriptionMilestone.milestone).all()
-
-    resultset1 = session.query(DescriptionMilestone.milestone,func.count(PendingTranslation.description_id)). \
-                        join(PendingTranslation, DescriptionMilestone.description_id == PendingTranslation.description_id).\
-                        filter(PendingTranslation.language_ref == language). \
-                        group_by(DescriptionMilestone.milestone).order_by(DescriptionMilestone.milestone).all()
-
-    resultset2 = session.query(DescriptionMilestone.milestone,func.count(DescriptionMilestone.description_id)). \
-                        group_by(DescriptionMilestone.milestone).order_by(DescriptionMilestone.milestone).all()
+    # Counted once per language and then kept up to date
+    progress = MilestoneProgress.for_language(session, language)
 
     params = dict()
-    resultdict = dict(resultset)
-    resultdict1 = dict(resultset1)
     params['lang'] = lang
     params['user'] = user
-    params['milestones'] = [(r[0], {'total': r[1], 'translated': resultdict.get(r[0],0), 'pending': resultdict1.get(r[0],0), 'percent': (resultdict.get(r[0],0)*100/r[1]) } ) for r in resultset2]
+    params['milestones'] = [(p.milestone, {'total': p.total, 'translated': p.translated, 'pending': p.pending, 'percent': (p.translated*100/p.total if p.total else 0) }) for p in progress]
+    session.commit()
 
     return render_to_response("milestones_lang.html", params, context_instance=RequestContext(request))
 
@@ -24,7 +24,7 @@ from django.http import Http404
 from django.template import RequestContext
 from django.contrib import messages
 from ddtp.database.db import with_db_session
-from ddtp.database.ddtss import Languages, Users, UserAuthority
+from ddtp.database.ddtss import Languages, Users, UserAuthority, TranslationQueue
 from ddtp.database.ddtp import CollectionMilestone, DescriptionMilestone
 from ddtp.ddtss.views import get_user
 from urlparse import urlsplit
@@ -210,6 +210,8 @@ def view_coordinator(session, request, language):
                 lang.milestone_high = form.cleaned_data['milestone_high']
                 lang.milestone_medium = form.cleaned_data['milestone_medium']
                 lang.milestone_low = form.cleaned_data['milestone_low']
+                # The scores depend on the milestones
+                TranslationQueue.invalidate(session, language)
                 # This little dance is needed because just changing the model doesn't mark the object dirty
                 model = lang.translation_model
                 session.expire(lang, ['translation_model'])
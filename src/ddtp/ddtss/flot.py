@@ -19,10 +19,11 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import time
 import json
+from datetime import date
 
 from django.http import Http404, HttpResponse
 from ddtp.database.db import with_db_session
-from ddtp.database.ddtp import DescriptionMilestone
+from ddtp.database.ddtp import DescriptionMilestone, MilestoneProgress
 from ddtp.database.ddtss import Languages
 
 from ddtp.ddtss.views import get_user
@@ -40,8 +41,14 @@ def milestone_data(session, request, language, milestone):
 
     # List of (date, package, total)
     flot_data = stat.raw_flot_data_language(language)
-    
-    milestone_data = [(time.mktime(date.timetuple())*1000, package, total, 100.0*package/total) for date, package, total in flot_data]
+
+    # The statistics are recorded daily, add where the milestone is now
+    progress = MilestoneProgress.get(session, milestone, language)
+    if progress and progress.total and (not flot_data or flot_data[-1][0] < date.today()):
+        flot_data.append((date.today(), progress.translated, progress.total))
+    session.commit()
+
+    milestone_data = [(time.mktime(day.timetuple())*1000, package, total, 100.0*package/total) for day, package, total in flot_data]
 
     return HttpResponse(json.dumps(milestone_data), mimetype="application/json")
 
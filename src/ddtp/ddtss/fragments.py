@@ -0,0 +1,139 @@
+"""
+DDTSS-Django - A Django implementation of the DDTP/DDTSS website.
+Copyright (C) 2011-2014 Martijn van Oosterhout <kleptog@svana.org>
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import time
+import hashlib
+import logging
+import threading
+
+from django.core.cache import cache
+
+from ddtp.database import db
+from ddtp.database.ddtss import FragmentGeneration, FragmentStats
+
+logger = logging.getLogger(__name__)
+
+# Parts of the dashboards that only change when a message is posted or a
+# translation is accepted are cached in the Django cache.  Each fragment
+# belongs to a scope, like the messages of a team, and its key includes the
+# generation of the scope.  The generations are kept in the database: the
+# views that write to a scope call invalidate() before their commit, which
+# starts a new generation together with the change.  Every process then
+# stops using the old fragments, whatever the cache backend, and they
+# simply expire.
+
+TIMEOUT = 300
+
+# Each process counts hits and misses in memory and adds them to
+# fragmentstats_tb at most this often (seconds)
+STATS_INTERVAL = 60
+
+# The fragments, for the statistics
+FRAGMENTS = ('global_messages', 'team_messages', 'user_messages', 'milestone', 'recently_translated')
+
+def global_scope():
+    return 'global'
+
+def team_scope(language):
+    return 'team:%s' % language
+
+def user_scope(username):
+    return 'user:%s' % username
+
+def translated_scope(language):
+    """ Things that change when a translation is accepted """
+    return 'translated:%s' % language
+
+def message_scopes(message):
+    """ Returns the scopes affected by writing or deleting a message.  Call
+    this before changing it. """
+    scopes = []
+    if message.from_user is not None and message.for_description is None:
+        if message.language is None and message.to_user is None:
+            scopes.append(global_scope())
+        elif message.language is not None:
+            scopes.append(team_scope(message.language))
+    if message.from_user is not None and message.to_user is not None:
+        scopes.append(user_scope(message.to_user))
+    if message.language is not None and message.actionstring == 'translation accepted':
+        scopes.append(translated_scope(message.language))
+    return scopes
+
+def _key(*parts):
+    """ Cache keys have restrictions on length and characters, so hash """
+    return 'ddtss:fragment:' + hashlib.md5(repr(parts)).hexdigest()
+
+def invalidate(session, *scopes):
+    """ Starts a new generation for each scope, as part of the transaction
+    of the session """
+    for scope in scopes:
+        FragmentGeneration.bump(session, scope)
+
+_stats_lock = threading.Lock()
+_stats = {}
+_stats_flushed = time.time()
+
+def _count(name, hit):
+    global _stats, _stats_flushed
+    with _stats_lock:
+        hits, misses = _stats.get(name, (0, 0))
+        _stats[name] = (hits + 1, misses) if hit else (hits, misses + 1)
+        if time.time() < _stats_flushed + STATS_INTERVAL:
+            return
+        counts, _stats, _stats_flushed = _stats, {}, time.time()
+    _flush_stats(counts)
+
+def _flush_stats(counts):
+    """ Adds the counts to fragmentstats_tb, in a transaction of its own so
+    it doesn't depend on whether the view commits """
+    session = db.get_db_session()
+    try:
+        for name, (hits, misses) in counts.iteritems():
+            FragmentStats.add(session, name, hits, misses)
+        session.commit()
+    except Exception:
+        logger.exception("Could not store the fragment cache statistics")
+    finally:
+        session.close()
+
+def get(session, name, scope, variant, make):
+    """ Returns the fragment name of scope, calling make() on a miss.  The
+    variant distinguishes versions of the fragment within the scope, e.g.
+    as seen by coordinators.  The value must be picklable. """
+    key = _key(name, scope, FragmentGeneration.get(session, scope), variant)
+    value = cache.get(key)
+    if value is not None:
+        _count(name, True)
+        return value
+    _count(name, False)
+    logger.debug("Fragment cache miss for %s of %s", name, scope)
+    value = make()
+    cache.set(key, value, TIMEOUT)
+    return value
+
+def stats(session):
+    """ Returns {name: (hits, misses)} for all fragments, as stored by the
+    web processes """
+    result = dict((name, (0, 0)) for name in FRAGMENTS)
+    for row in session.query(FragmentStats):
+        result[row.fragment] = (row.hits, row.misses)
+    return result
+
+def reset_stats(session):
+    session.execute("DELETE FROM fragmentstats_tb")
@@ -29,17 +29,19 @@ from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response, redirect
 from django.http import Http404, HttpResponseForbidden, HttpResponse
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 from ddtp.database.db import with_db_session
-from ddtp.database.ddtp import Description, ActiveDescription, Translation, PackageVersion, DescriptionMilestone
+from ddtp.database.ddtp import Description, ActiveDescription, PackageVersion, \
+    MilestoneProgress, load_part_translations
 from ddtp.database.ddtss import Languages, PendingTranslation, PendingTranslationReview, Users, Messages, \
-    Wordlist
+    Wordlist, TranslationQueue, TranslationCounts, PrefetchedSuggestion
 from urlparse import urlsplit
 from sqlalchemy import func
-from sqlalchemy.sql import expression
-from sqlalchemy.orm import subqueryload
 
 from ddtp.ddtss.translationmodel import DefaultTranslationModel
+from ddtp.ddtss import fragments
 
 
 # Get an instance of a logger
@@ -56,36 +58,27 @@ def view_index(session, request, lang=None):
     if lang != 'xx':
         return redirect('ddtss_index_lang', lang)
 
-    pending_translations = session.query(Languages, \
-                                         func.sum(expression.case([(PendingTranslation.state == PendingTranslation.STATE_PENDING_TRANSLATION, 1)], else_=0)), \
-                                         func.sum(expression.case([(PendingTranslation.state == PendingTranslation.STATE_PENDING_REVIEW, 1)], else_=0))) \
-                                  .outerjoin(PendingTranslation) \
-                                  .group_by(Languages) \
-                                  .all()
-
-    translated = session.query(Languages.language, func.count(Translation.description_id)) \
-                        .join(Translation, Translation.language == Languages.language) \
-                        .group_by(Languages.language) \
-                        .all()
-
-    # Convert (lang,count) pairs to dict
-    translated = dict(translated)
+    # The counts are maintained in translationcounts_tb, missing ones are
+    # recounted and stored
+    counts = TranslationCounts.get_all(session)
+    session.commit()
 
     # Combine into one resultset
     languages = []
     total_pending_translation = 0
     total_pending_review = 0
     total_translated = 0
-    for row in pending_translations:
-        languages.append(dict(language=row[0].language,
-                            fullname=row[0].fullname,
-                            enabled=row[0].enabled_ddtss,
-                            pending_translation=row[1],
-                            pending_review=row[2],
-                            translated=translated.get(row[0].language, 0)))
-        total_pending_translation += row[1]
-        total_pending_review += row[2]
-        total_translated += translated.get(row[0].language, 0)
+    for lang in session.query(Languages).all():
+        lang_counts = counts[lang.language]
+        languages.append(dict(language=lang.language,
+                            fullname=lang.fullname,
+                            enabled=lang.enabled_ddtss,
+                            pending_translation=lang_counts.pending_translation,
+                            pending_review=lang_counts.pending_review,
+                            translated=lang_counts.translated))
+        total_pending_translation += lang_counts.pending_translation
+        total_pending_review += lang_counts.pending_review
+        total_translated += lang_counts.translated
 
     # Sort by translated descending
     #languages.sort(key=lambda x:x['translated'], reverse=True)
@@ -132,6 +125,9 @@ def save_user(response, user):
     response.set_cookie('ddtssuser', cookie, max_age=6 * 30 * 86400)
     return response
 
+# Number of entries shown per page of the lists on the language dashboard
+DASHBOARD_PAGE_SIZE = 100
+
 class FetchForm(forms.Form):
     """ This form is used to encapsulate the results of Fetch request """
     package = forms.CharField(max_length=80, required=False)
@@ -205,58 +201,96 @@ def view_index_lang(session, request, language):
                         owner_locktime=int(time.time()),
                         iteration=0,
                         state=0)
-                trans.short, trans.long = PendingTranslation.make_suggestion(description, language)
+                trans.short, trans.long = PrefetchedSuggestion.take(session, description, language)
                 session.add(trans)
+                TranslationQueue.remove(session, language, description_id)
+                TranslationCounts.adjust(session, language, pending_translation=1)
+                MilestoneProgress.adjust(session, language, description_id, pending=1)
                 session.commit()
                 return show_message_screen(request, 'Fetched package %s (%s)' % (description.package, str(description_id)), 'ddtss_translate', language, str(description_id))
 
         return show_message_screen(request, 'Package %s already translated (and not forced)' % (pack), 'ddtss_index_lang', language)
 
+    # Before the commit, as missing counts are recounted and stored
+    counts = TranslationCounts.get(session, language)
     session.commit()
 
-    # TODO: Don't load actual descriptions
-    translations = session.query(PendingTranslation,
-                                 func.sum(expression.case([(PendingTranslationReview.username == user.username, 1)], else_=0)).label('reviewed'),
-                                 func.count().label('reviews')) \
-                          .outerjoin(PendingTranslationReview) \
-                          .filter(PendingTranslation.language_ref == language) \
-                          .group_by(PendingTranslation) \
-                          .options(subqueryload(PendingTranslation.reviews)) \
-                          .options(subqueryload(PendingTranslation.description)) \
-                          .options(subqueryload('description.milestones')) \
-                          .all()
-
-    pending_translations = []
-    pending_review = []
-    reviewed = []
-
-    for trans, reviewed_by_me, reviews in translations:
-        if trans.state == PendingTranslation.STATE_PENDING_REVIEW:
-            if reviewed_by_me or trans.owner_username == user.username:
-                reviewed.append(trans)
-            else:
-                pending_review.append(trans)
-        elif trans.state == PendingTranslation.STATE_PENDING_TRANSLATION:
-            pending_translations.append(trans)
-
-    reviewed.sort(key=lambda t: t.lastupdate, reverse=True)
-    pending_review.sort(key=lambda t: t.lastupdate, reverse=False)
-    pending_translations.sort(key=lambda t: t.firstupdate, reverse=False)
-
-    global_messages = Messages.global_messages(session) \
-                          .order_by(Messages.timestamp.desc()) \
-                          .limit(20) \
-                          .all()
-
-    team_messages = Messages.team_messages(session, language) \
-                          .order_by(Messages.timestamp.desc()) \
-                          .limit(20) \
-                          .all()
-
-    user_messages = Messages.user_messages(session, user.username) \
-                          .order_by(Messages.timestamp.desc()) \
-                          .limit(20) \
-                          .all()
+    # The lists can be long, so they are shown a page at a time.  The
+    # request says where each page starts, see PendingTranslation.summaries()
+    flagged = (lang.milestone_high, lang.milestone_medium, lang.milestone_low, user.milestone)
+    pages = dict()
+    for which in (PendingTranslation.LIST_PENDING_TRANSLATION,
+                  PendingTranslation.LIST_PENDING_REVIEW,
+                  PendingTranslation.LIST_REVIEWED):
+        after = None
+        m = re.match(r'^(\d+)\.(\d+)$', request.GET.get(which, ''))
+        if m:
+            after = int(m.group(1)), int(m.group(2))
+        summaries = PendingTranslation.summaries(session, language, user.username, which, flagged, after, DASHBOARD_PAGE_SIZE + 1)
+        more = len(summaries) > DASHBOARD_PAGE_SIZE
+        summaries = summaries[:DASHBOARD_PAGE_SIZE]
+        pages[which] = dict(list=summaries,
+                            paged=after is not None,
+                            next=summaries[-1].page_key if more else None)
+
+    # Counted live, as it depends on the user and only covers the few
+    # translations they touched.  It is subtracted from the cached count
+    # below, which can lag behind until reconciled, hence the max().
+    reviewed_count = session.query(func.count(PendingTranslation.pending_translation_id)) \
+                            .filter(PendingTranslation.language_ref == language) \
+                            .filter(PendingTranslation.state == PendingTranslation.STATE_PENDING_REVIEW) \
+                            .filter((PendingTranslation.owner_username == user.username) |
+                                    PendingTranslation.reviews.any(PendingTranslationReview.username == user.username)) \
+                            .scalar()
+
+    # The blocks below only change when a message is posted or a
+    # translation accepted, so they come from the fragment cache
+    def make_global_messages():
+        global_messages = Messages.global_messages(session) \
+                              .order_by(Messages.timestamp.desc()) \
+                              .limit(20) \
+                              .all()
+        return render_to_string("ddtss/fragment_global_messages.html", dict(
+            user=user,
+            global_messages=global_messages))
+
+    def make_team_messages():
+        team_messages = Messages.team_messages(session, language) \
+                              .order_by(Messages.timestamp.desc()) \
+                              .limit(20) \
+                              .all()
+        return render_to_string("ddtss/fragment_team_messages.html", dict(
+            lang=lang,
+            user=user,
+            team_messages=team_messages))
+
+    def make_user_messages():
+        user_messages = Messages.user_messages(session, user.username) \
+                              .order_by(Messages.timestamp.desc()) \
+                              .limit(20) \
+                              .all()
+        return render_to_string("ddtss/fragment_user_messages.html", dict(
+            user_messages=user_messages))
+
+    def make_recently_translated():
+        recently_translated = Messages.recently_translated(session, language).limit(10).all()
+        return render_to_string("ddtss/fragment_recently_translated.html", dict(
+            recently_translated=recently_translated))
+
+    def make_milestone(milestone):
+        progress = MilestoneProgress.get(session, milestone, language)
+        if not progress:
+            return {}
+        return progress.info()
+
+    global_messages = fragments.get(session, 'global_messages', fragments.global_scope(),
+                                    bool(user.is_superuser), make_global_messages)
+    team_messages = fragments.get(session, 'team_messages', fragments.team_scope(language),
+                                  bool(user.is_coordinator), make_team_messages)
+    user_messages = fragments.get(session, 'user_messages', fragments.user_scope(user.username),
+                                  None, make_user_messages)
+    recently_translated = fragments.get(session, 'recently_translated', fragments.translated_scope(language),
+                                        None, make_recently_translated)
 
     milestones = []
     for type, name, milestone in (('user_milestone', 'User', user.milestone),
@@ -265,31 +299,36 @@ def view_index_lang(session, request, language):
                                   ('lang_milestone_low', 'Team low', lang.milestone_low)):
         if not milestone:
             continue
-        m = session.query(DescriptionMilestone).filter(DescriptionMilestone.milestone == milestone).first()
-        if not m:
+        info = fragments.get(session, 'milestone', fragments.translated_scope(language),
+                             milestone, lambda: make_milestone(milestone))
+        if not info:
             continue
 
-        info = m.info_language(lang)
+        info = dict(info)
         info['type'] = type
         info['typename'] = name
         milestones.append(info)
+    # Keep any progress that had to be counted
+    session.commit()
 
     involveddescriptions = [x for x, in Messages.involveddescriptions(session, user.username).all()]
-    recently_translated = Messages.recently_translated(session, language).limit(10).all()
 
     response = render_to_response("ddtss/index_lang.html", dict(
         lang=lang,
         user=user,
         auth=user.get_authority(language),
-        pending_translations=pending_translations,
-        pending_review=pending_review,
-        reviewed=reviewed,
+        pending_translations=pages[PendingTranslation.LIST_PENDING_TRANSLATION],
+        pending_review=pages[PendingTranslation.LIST_PENDING_REVIEW],
+        reviewed=pages[PendingTranslation.LIST_REVIEWED],
+        pending_translations_count=counts.pending_translation,
+        pending_review_count=max(0, counts.pending_review - reviewed_count),
+        reviewed_count=reviewed_count,
         involveddescriptions=involveddescriptions,
         milestones=milestones,
-        recently_translated=recently_translated,
-        global_messages=global_messages,
-        team_messages=team_messages,
-        user_messages=user_messages), context_instance=RequestContext(request))
+        recently_translated=mark_safe(recently_translated),
+        global_messages=mark_safe(global_messages),
+        team_messages=mark_safe(team_messages),
+        user_messages=mark_safe(user_messages)), context_instance=RequestContext(request))
 
     return save_user(response, user)
 
@@ -362,9 +401,12 @@ def view_translate(session, request, language, description_id):
                 iteration=0,
                 state=PendingTranslation.STATE_PENDING_TRANSLATION)
 
-        # Make a suggestion for the new translation
-        trans.short, trans.long = PendingTranslation.make_suggestion(descr, language)
+        # Make a suggestion for the new translation, if it wasn't prefetched
+        trans.short, trans.long = PrefetchedSuggestion.take(session, descr, language)
         session.add(trans)
+        TranslationQueue.remove(session, language, description_id)
+        TranslationCounts.adjust(session, language, pending_translation=1)
+        MilestoneProgress.adjust(session, language, description_id, pending=1)
 
     if trans.state != PendingTranslation.STATE_PENDING_TRANSLATION:
         session.commit()
@@ -433,16 +475,20 @@ def view_translate(session, request, language, description_id):
                              .all()
 
     olddiffs = list()
-    for olddescr in descr.get_description_predecessors:
+    predecessors = descr.get_description_predecessors
+    # Look up all the parts in one go
+    part_translations = load_part_translations(session, [descr] + predecessors, language)
+    transshort, translong = PendingTranslation.make_quick_suggestion(descr, language, part_translations[descr.description_id])
+    for olddescr in predecessors:
         oneolddiff = dict()
         oneolddiff['id'] = descr.description_id
         oneolddiff['short'] = descr.short()
         oneolddiff['long'] = descr.long()
-        oneolddiff['transshort'], oneolddiff['translong'] = PendingTranslation.make_quick_suggestion(descr, language)
+        oneolddiff['transshort'], oneolddiff['translong'] = transshort, translong
         oneolddiff['oldid'] = olddescr.description_id
         oneolddiff['oldshort'] = olddescr.short()
         oneolddiff['oldlong'] = olddescr.long()
-        oneolddiff['oldtransshort'], oneolddiff['oldtranslong'] = PendingTranslation.make_quick_suggestion(olddescr, language)
+        oneolddiff['oldtransshort'], oneolddiff['oldtranslong'] = PendingTranslation.make_quick_suggestion(olddescr, language, part_translations[olddescr.description_id])
         oneolddiff['diff_short'] = generate_line_diff(oneolddiff['oldshort'], oneolddiff['short'])
         oneolddiff['diff_transshort'] = generate_line_diff(oneolddiff['oldtransshort'], oneolddiff['transshort'])
         oneolddiff['diff_long'] = generate_line_diff(oneolddiff['oldlong'], oneolddiff['long'])
@@ -640,6 +686,7 @@ def view_review(session, request, language, description_id):
             if lang.translation_model.translation_accepted(trans):
                 # Translation has been accepted, yay!
                 trans.accept_translation()
+                fragments.invalidate(session, fragments.translated_scope(language))
                 session.commit()
                 return show_message_screen(request, 'Translation accepted', 'ddtss_index_lang', language)
 
@@ -695,16 +742,20 @@ def view_review(session, request, language, description_id):
                              .all()
 
     olddiffs = list()
-    for olddescr in descr.get_description_predecessors:
+    predecessors = descr.get_description_predecessors
+    # Look up all the parts in one go
+    part_translations = load_part_translations(session, [descr] + predecessors, language)
+    transshort, translong = PendingTranslation.make_quick_suggestion(descr, language, part_translations[descr.description_id])
+    for olddescr in predecessors:
         oneolddiff = dict()
         oneolddiff['id'] = descr.description_id
         oneolddiff['short'] = descr.short()
         oneolddiff['long'] = descr.long()
-        oneolddiff['transshort'], oneolddiff['translong'] = PendingTranslation.make_quick_suggestion(descr, language)
+        oneolddiff['transshort'], oneolddiff['translong'] = transshort, translong
         oneolddiff['oldid'] = olddescr.description_id
         oneolddiff['oldshort'] = olddescr.short()
         oneolddiff['oldlong'] = olddescr.long()
-        oneolddiff['oldtransshort'], oneolddiff['oldtranslong'] = PendingTranslation.make_quick_suggestion(olddescr, language)
+        oneolddiff['oldtransshort'], oneolddiff['oldtranslong'] = PendingTranslation.make_quick_suggestion(olddescr, language, part_translations[olddescr.description_id])
         oneolddiff['diff_short'] = generate_line_diff(oneolddiff['oldshort'], oneolddiff['short'])
         oneolddiff['diff_transshort'] = generate_line_diff(oneolddiff['oldtransshort'], oneolddiff['transshort'])
         oneolddiff['diff_long'] = generate_line_diff(oneolddiff['oldlong'], oneolddiff['long'])
@@ -785,6 +836,7 @@ def view_write_message(session, request, type, language=None, description=None,
                     timestamp=int(time.time()))
 
             session.add(message)
+            fragments.invalidate(session, *fragments.message_scopes(message))
 
             session.commit()
             message_suffix = None
@@ -834,12 +886,14 @@ def view_delmessage(session, request, message_id):
             .one()
 
     auth = user.get_authority(message.language)
+    scopes = fragments.message_scopes(message)
 
     # special, if to_user and for_description set...
     # remove only the to_user
     if (message.to_user and message.for_description) \
             and (user.is_superuser or auth.auth_level == auth.AUTH_LEVEL_COORDINATOR or user.username == message.to_user or user.username == message.from_user):
         message.to_user = None;
+        fragments.invalidate(session, *scopes)
         session.commit()
 
         return redirect(redirect_to)
@@ -854,6 +908,7 @@ def view_delmessage(session, request, message_id):
             message.message = ""
         else:
             session.delete(message)
+        fragments.invalidate(session, *scopes)
         session.commit()
 
         return redirect(redirect_to)
@@ -863,6 +918,7 @@ def view_delmessage(session, request, message_id):
             and message.to_user is None \
             and message.description_id is None:
         session.delete(message)
+        fragments.invalidate(session, *scopes)
         session.commit()
 
         return redirect(redirect_to)
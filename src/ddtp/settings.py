@@ -117,6 +117,9 @@ DDTP_DATABASE=dict(drivername='postgresql',
 DDTSS_LOCK_TIMEOUT=900
 # If true, disables various permission checks
 DEMO_MODE=False
+# Directory where update_fuzzy_matches keeps the index of the translated
+# parts of each language between runs, None to build it every time
+DDTP_FUZZY_INDEX_DIR=os.path.join(os.path.dirname(__file__), 'fuzzy-index')
 
 # File to save all logging messages.
 LOGFILE_NAME = '/var/log/ddtss/ddtss.log'